@@ -0,0 +1,58 @@
+"""
+Micro-benchmark: RFC 822 date conversion
+
+convert_rfc822_to_mysql_datetime (email.utils.parsedate + string
+formatting) against convert_rfc822_to_datetime (Twilio format parser
+with a cache). The dates are drawn from 100 distinct dates, like in a
+page of resources, then they are all distinct: no cache hits.
+
+python benchmarks/bench_dates.py [number of conversions]
+"""
+import os
+import sys
+import time
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from twilioresourcesdb import resources
+
+def dates(n, distinct):
+    """
+    Return n RFC 822 dates in random order, each of the distinct dates
+    repeated n / distinct times
+
+    @param n number of dates
+    @param distinct number of distinct dates
+    """
+    # one second apart from 2009-07-17 01:52:49
+    base = [time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(1247795569 + i))
+            for i in range(distinct)]
+    values = [base[i % distinct] for i in range(n)]
+    random.shuffle(values)
+    return values
+
+def bench(name, f, values, repeat=3):
+    """
+    Print best time of converting all values
+
+    @param name benchmark name
+    @param f conversion function
+    @param values list of dates
+    """
+    t = min(timeit.repeat(lambda: [f(v) for v in values], number=1, repeat=repeat))
+    print '%-40s %8.1f ms %8.2f us/date' % (name, t * 1000, t * 1e6 / len(values))
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for distinct in (100, n):
+        values = dates(n, distinct)
+        print '%d dates, %d distinct' % (n, distinct)
+        bench('convert_rfc822_to_mysql_datetime', 
+              resources.convert_rfc822_to_mysql_datetime, values)
+        def uncached(v):
+            resources.date_cache.clear()
+            return resources.convert_rfc822_to_datetime(v)
+        bench('convert_rfc822_to_datetime (no cache)', uncached, values)
+        resources.date_cache.clear()
+        bench('convert_rfc822_to_datetime', resources.convert_rfc822_to_datetime, values)
@@ -0,0 +1,252 @@
+"""
+Ingest benchmark: Resources.process against a local fake Twilio API
+(fake_twilio.py) serving synthetic resources (synthetic.py).
+
+Scenarios:
+cold: backfill of the calls, SMS messages and recordings in an empty DB
+steady: backfill, then cycles adding a few new resources each time
+active: a large set of in-progress calls completed after the first cycle
+
+Each scenario runs in its own process and reports rows/sec, requests
+per row and peak RSS. The fake API runs in a child process generating
+the resources: the peak RSS is the one of Resources only.
+
+python benchmarks/bench_ingest.py --backend sqlite --calls 10000
+python benchmarks/bench_ingest.py --backend sqlite --db-name :memory: --bulk
+python benchmarks/bench_ingest.py cold --page-size 1000 --stream
+python benchmarks/bench_ingest.py --backend postgresql --db-name bench --wipe
+
+The PostgreSQL/MySQL tables and the Redis DB are wiped before each
+scenario: only use a dedicated DB, --wipe is required.
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+import argparse
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from twilioresourcesdb import resources
+
+from fake_twilio import FakeTwilioProcess
+from synthetic import Generator
+
+account_sid = 'AC' + 'b' * 32
+
+def settings(options, server):
+    """
+    Return Resources settings
+
+    @param options command line options
+    @param server FakeTwilioProcess
+    """
+    # spilled active resources are polled at each cycle: active_spill_interval=0
+    s = dict(account_sid=account_sid, account_token='x', api_base_url=server.url,
+             database_type=options.backend, database_name=options.db_name,
+             bulk_insert=options.bulk, workers=options.workers,
+             prefetch_pages=options.prefetch, page_size=options.page_size,
+             sync_mode=options.sync_mode, active_refresh=options.active_refresh,
+             active_max_size=options.active_max_size, active_spill_interval=0,
+             stream_pages=options.stream, json_decoder=options.json_decoder,
+             checkpoints=True)
+    for name in ('user', 'password', 'host', 'port'):
+        value = getattr(options, 'db_' + name)
+        if value:
+            s['database_' + name] = value
+    return s
+
+def make_resources(options, server):
+    """
+    Return Resources object
+    """
+    r = resources.Resources(settings(options, server))
+    r.dbg_level = 0
+    return r
+
+def wipe(options, server):
+    """
+    Empty the DB
+    """
+    if options.backend == 'sqlite':
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(options.db_name + suffix):
+                os.remove(options.db_name + suffix)
+        return
+    r = make_resources(options, server)
+    if r.sql:
+        r.session.close()
+        r.metadata.drop_all(r.engine)
+        r.engine.dispose()
+        resources.build_schema()['schema_info'].drop(r.engine, checkfirst=True)
+        resources.build_schema()['schema_migrations'].drop(r.engine, checkfirst=True)
+    else:
+        r.redis.flushdb()
+
+def rows(r):
+    """
+    Return number of rows inserted so far
+    """
+    return sum(r.metrics.snapshot()['counters'].get('rows_inserted_total', {}).values())
+
+# functions called in the server process: server is the FakeTwilio object
+
+def start_generator(server):
+    """
+    Create the resources generator of the server
+    """
+    server.generator = Generator(account_sid)
+
+def backfill(server, options):
+    """
+    Add the resources of a backfill to the server
+    """
+    g = server.generator
+    server.add('accounts', [g.account()])
+    calls = g.calls(options.calls)
+    server.add('calls', calls)
+    server.add('sms_messages', g.sms_messages(options.sms))
+    server.add('recordings', g.recordings(calls[-options.recordings:] if options.recordings else []))
+
+def add_new(server, n):
+    """
+    Add n calls and n SMS messages to the server
+    """
+    server.add('calls', server.generator.calls(n))
+    server.add('sms_messages', server.generator.sms_messages(n))
+
+def add_active(server, n):
+    """
+    Add the account and n calls in progress to the server
+    """
+    server.add('accounts', [server.generator.account()])
+    server.add('calls', server.generator.calls(n, status='in-progress'))
+
+def complete_active(server):
+    """
+    Complete the calls in progress
+    """
+    for c in server.data['calls']:
+        if c['status'] == 'in-progress':
+            server.update(c['sid'], status='completed', end_time=c['date_created'], duration='42')
+
+# scenarios
+
+def cold(options, server):
+    """
+    Backfill an empty DB
+
+    @return (rows, requests, seconds)
+    """
+    server.call(backfill, options)
+    r = make_resources(options, server)
+    start = time.time()
+    r.process()
+    return rows(r), server.stats()['requests'], time.time() - start
+
+def steady(options, server):
+    """
+    Cycles adding options.new calls and SMS messages after a backfill:
+    only the cycles are measured
+
+    @return (rows, requests, seconds)
+    """
+    server.call(backfill, options)
+    r = make_resources(options, server)
+    r.process()
+    inserted, requests = rows(r), server.stats()['requests']
+    seconds = 0.0
+    for i in range(options.cycles):
+        server.call(add_new, options.new)
+        start = time.time()
+        r.process()
+        seconds += time.time() - start
+    return rows(r) - inserted, server.stats()['requests'] - requests, seconds
+
+def active(options, server):
+    """
+    options.active calls in progress during the first cycle, completed
+    before the next cycles: only the cycles settling them are measured
+
+    @return (rows, requests, seconds)
+    """
+    server.call(add_active, options.active)
+    r = make_resources(options, server)
+    r.process()
+    inserted, requests = rows(r), server.stats()['requests']
+    server.call(complete_active)
+    start = time.time()
+    for i in range(options.cycles):
+        r.process()
+        if not sum(len(lr['active']) for lr in r.list_resources):
+            break
+    # active resources completed are added one by one
+    settled = options.active - sum(len(lr['active']) for lr in r.list_resources)
+    return settled, server.stats()['requests'] - requests, time.time() - start
+
+scenarios = dict(cold=cold, steady=steady, active=active)
+
+def run(name, options, queue):
+    """
+    Run scenario in this process, put result in queue
+    """
+    server = FakeTwilioProcess(account_sid, latency=options.latency, error_rate=options.error_rate)
+    try:
+        server.call(start_generator)
+        wipe(options, server)
+        inserted, requests, seconds = scenarios[name](options, server)
+        queue.put(dict(scenario=name, rows=inserted, requests=requests, seconds=seconds,
+            rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resources ingest benchmark')
+    parser.add_argument('scenarios', nargs='*', default=['cold', 'steady', 'active'],
+                        help='cold, steady, active (default: all)')
+    parser.add_argument('--backend', default='sqlite', help='sqlite, postgresql, mysql or redis')
+    parser.add_argument('--db-name', default=None, help="DB name, SQLite file or ':memory:'")
+    parser.add_argument('--db-user')
+    parser.add_argument('--db-password')
+    parser.add_argument('--db-host')
+    parser.add_argument('--db-port', type=int)
+    parser.add_argument('--wipe', action='store_true', help='allow wiping a PostgreSQL/MySQL/Redis DB')
+    parser.add_argument('--calls', type=int, default=10000)
+    parser.add_argument('--sms', type=int, default=10000)
+    parser.add_argument('--recordings', type=int, default=1000)
+    parser.add_argument('--active', type=int, default=2000, help='active calls')
+    parser.add_argument('--new', type=int, default=20, help='new calls and SMS messages per steady cycle')
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='ratio of requests failing')
+    parser.add_argument('--bulk', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--prefetch', type=int, default=0)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--sync-mode', default='count')
+    parser.add_argument('--active-refresh', default='poll')
+    parser.add_argument('--active-max-size', type=int, default=10000,
+                        help='active resources kept in memory, spilled over to the DB beyond')
+    parser.add_argument('--stream', action='store_true', help='stream pages (requires ijson)')
+    parser.add_argument('--json-decoder', default='auto', help='auto, orjson, ujson, simplejson or json')
+    options = parser.parse_args()
+    if options.backend == 'sqlite':
+        if not options.db_name:
+            options.db_name = os.path.join(tempfile.gettempdir(), 'bench_ingest.db')
+    elif not options.wipe:
+        parser.error('the %s DB is wiped before each scenario: use --wipe' % options.backend)
+    print '%-8s %-10s %8s %9s %10s %9s %8s %9s' % ('scenario', 'backend', 'rows', 'seconds',
+        'rows/sec', 'requests', 'req/row', 'RSS (MB)')
+    for name in options.scenarios:
+        queue = Queue()
+        p = Process(target=run, args=(name, options, queue))
+        p.start()
+        p.join()
+        if queue.empty():
+            print '%-8s %-10s failed' % (name, options.backend)
+            continue
+        d = queue.get()
+        print '%-8s %-10s %8d %9.2f %10.1f %9d %8.3f %9.1f' % (name, options.backend, d['rows'],
+            d['seconds'], d['rows'] / d['seconds'] if d['seconds'] else 0, d['requests'],
+            float(d['requests']) / d['rows'] if d['rows'] else 0, d['rss'])
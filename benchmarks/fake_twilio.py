@@ -0,0 +1,323 @@
+"""
+Local stand-in for the Twilio 2010-04-01 REST API used by
+twilioresourcesdb: list endpoints with paging, next_page_uri and the
+Status/date filters, instance endpoints and recordings audio files.
+Latency and errors (500 or 429 with Retry-After) can be injected.
+FakeTwilioProcess runs the server in a child process.
+"""
+import random
+import re
+import socket
+import sys
+import time
+import traceback
+import urlparse
+from multiprocessing import Process, Pipe
+from collections import OrderedDict
+from threading import Thread, Lock
+import BaseHTTPServer
+import SocketServer
+
+import simplejson
+
+api_version = '2010-04-01'
+
+# list URL name -> JSON list key
+lists = {
+    'Calls': 'calls',
+    'SMS/Messages': 'sms_messages',
+    'Recordings': 'recordings',
+    'Transcriptions': 'transcriptions',
+    'Notifications': 'notifications',
+    'Conferences': 'conferences',
+    'OutgoingCallerIds': 'outgoing_caller_ids',
+    'IncomingPhoneNumbers': 'incoming_phone_numbers',
+}
+
+# date filter -> resource attribute
+date_filters = {
+    'StartTime': 'start_time',
+    'DateSent': 'date_sent',
+    'DateCreated': 'date_created',
+    'MessageDate': 'message_date',
+}
+
+months = dict((m, i + 1) for i, m in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')))
+
+def day(date):
+    """
+    Return YYYY-MM-DD of a RFC 822 date
+
+    @param date 'Fri, 17 Jul 2009 01:52:49 +0000'
+    """
+    wday, d, month, year = date.split(' ')[:4]
+    return '%s-%02d-%02d' % (year, months[month], int(d))
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing the connection before the end of a page
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+class FakeTwilio(object):
+    """
+    Fake Twilio API server running in a thread
+    """
+    def __init__(self, account_sid, port=0, latency=0.0, error_rate=0.0,
+                 recording_size=100000):
+        """
+        Class instantiation: start server
+
+        @param account_sid account SID
+        @param port port number, 0 for any free port
+        @param latency number of seconds added to each response
+        @param error_rate ratio of requests failing with a 500 or a 429
+        @param recording_size recordings audio files size in bytes
+        """
+        self.account_sid = account_sid
+        self.latency = latency
+        self.error_rate = error_rate
+        self.recording_size = recording_size
+        self.lock = Lock()
+        # list key -> resources, newest first
+        self.data = dict((key, []) for key in lists.values())
+        self.data['accounts'] = []
+        # SID -> resource
+        self.resources = {}
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        server = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.port = self.server.server_address[1]
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, key, resources):
+        """
+        Add resources, oldest first
+
+        @param key list key: calls, sms_messages...
+        @param resources list of resources
+        """
+        with self.lock:
+            self.data[key][0:0] = reversed(resources)
+            for r in resources:
+                self.resources[r['sid']] = r
+
+    def update(self, sid, **fields):
+        """
+        Update resource
+
+        @param sid resource SID
+        @param fields attributes updated
+        """
+        with self.lock:
+            self.resources[sid].update(fields)
+
+    def stats(self):
+        """
+        Server statistics
+
+        @return dict: requests, errors, bytes
+        """
+        with self.lock:
+            return dict(requests=self.requests, errors=self.errors, bytes=self.bytes)
+
+    def close(self):
+        """
+        Stop server
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request):
+        """
+        Handle GET request
+
+        @param request BaseHTTPRequestHandler
+        """
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            if random.random() < 0.5:
+                return self.send(request, 500, '{"status": 500}')
+            return self.send(request, 429, '{"status": 429}', headers={'Retry-After': '0'})
+        u = urlparse.urlparse(request.path)
+        params = dict(urlparse.parse_qsl(u.query))
+        prefix = '/%s/Accounts' % api_version
+        if u.path == prefix + '.json':
+            return self.send_list(request, u.path, 'accounts', params)
+        m = re.match(r'%s/(\w+)(?:/(.+?))?(?:\.json)?$' % prefix, u.path)
+        if not m or m.group(1) != self.account_sid:
+            return self.send(request, 404, '{"status": 404}')
+        path = m.group(2)
+        if path is None:
+            return self.send_resource(request, self.account_sid)
+        if path in lists:
+            return self.send_list(request, u.path, lists[path], params)
+        name, sid = path.rsplit('/', 1)
+        if not name in lists:
+            return self.send(request, 404, '{"status": 404}')
+        if name == 'Recordings' and not u.path.endswith('.json'):
+            return self.send_audio(request, sid.split('.')[0])
+        return self.send_resource(request, sid)
+
+    def send_list(self, request, path, key, params):
+        """
+        Send page of resources
+        """
+        page = int(params.get('Page', 0))
+        page_size = int(params.get('PageSize', 50))
+        with self.lock:
+            resources = self.data[key]
+            if 'Status' in params:
+                resources = [r for r in resources if r.get('status') == params['Status']]
+            for name, attribute in date_filters.items():
+                if name + '>' in params:
+                    resources = [r for r in resources if r.get(attribute) and
+                                 day(r[attribute]) >= params[name + '>']]
+            total = len(resources)
+            items = resources[page * page_size:(page + 1) * page_size]
+        num_pages = max(1, (total + page_size - 1) // page_size)
+        next_page_uri = None
+        if page + 1 < num_pages:
+            next_params = dict(params, Page=page + 1, PageSize=page_size)
+            next_page_uri = '%s?%s' % (path, '&'.join('%s=%s' % kv for kv in sorted(next_params.items())))
+        # page attributes first, as in the API responses
+        d = OrderedDict([('page', page), ('num_pages', num_pages), ('page_size', page_size),
+             ('total', total), ('start', page * page_size), ('end', page * page_size + len(items)),
+             ('uri', path), ('next_page_uri', next_page_uri), (key, items)])
+        self.send(request, 200, simplejson.dumps(d))
+
+    def send_resource(self, request, sid):
+        """
+        Send resource
+        """
+        with self.lock:
+            resource = self.resources.get(sid)
+            body = simplejson.dumps(resource) if resource else None
+        if body is None:
+            return self.send(request, 404, '{"status": 404}')
+        self.send(request, 200, body)
+
+    def send_audio(self, request, sid):
+        """
+        Send recording audio file, honours Range
+        """
+        if not sid in self.resources:
+            return self.send(request, 404, '{"status": 404}')
+        body = 'RIFF' + '\0' * (self.recording_size - 4)
+        r = request.headers.get('Range')
+        if r:
+            offset = int(r.split('=')[1].rstrip('-'))
+            return self.send(request, 206, body[offset:], 'audio/x-wav')
+        self.send(request, 200, body, 'audio/x-wav')
+
+    def send(self, request, status, body, content_type='application/json', headers=None):
+        """
+        Send response
+        """
+        with self.lock:
+            self.bytes += len(body)
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            request.send_header(k, v)
+        request.end_headers()
+        request.wfile.write(body)
+
+def server_stats(server):
+    """
+    Return FakeTwilio statistics, called in the server process
+    """
+    return server.stats()
+
+def serve(conn, account_sid, options):
+    """
+    Child process of FakeTwilioProcess: run the server, call the functions
+    received until None is received
+
+    @param conn Pipe connection
+    @param account_sid account SID
+    @param options FakeTwilio options
+    """
+    server = FakeTwilio(account_sid, **options)
+    conn.send(server.url)
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+            f, args = message
+            try:
+                conn.send((True, f(server, *args)))
+            except Exception:
+                conn.send((False, traceback.format_exc()))
+    finally:
+        server.close()
+
+class FakeTwilioProcess(object):
+    """
+    FakeTwilio running in a child process: its resources and the JSON
+    encoding do not count in the memory of the process using the API. The
+    resources are generated and changed in the child process by the
+    functions passed to call().
+    """
+    def __init__(self, account_sid, **options):
+        """
+        Class instantiation: start server process
+
+        @param account_sid account SID
+        @param options FakeTwilio options: port, latency, error_rate...
+        """
+        self.conn, child = Pipe()
+        self.process = Process(target=serve, args=(child, account_sid, options))
+        self.process.daemon = True
+        self.process.start()
+        self.url = self.conn.recv()
+
+    def call(self, f, *args):
+        """
+        Call function in the server process: f(server, *args)
+
+        @param f module level function
+        @return f return value
+        """
+        self.conn.send((f, args))
+        ok, result = self.conn.recv()
+        if not ok:
+            raise Exception('server process: %s' % result)
+        return result
+
+    def stats(self):
+        """
+        Server statistics
+        """
+        return self.call(server_stats)
+
+    def close(self):
+        """
+        Stop server process
+        """
+        self.conn.send(None)
+        self.process.join()
@@ -0,0 +1,123 @@
+"""
+Synthetic Twilio resources: accounts, calls, SMS messages and recordings
+in the 2010-04-01 API JSON format. Each resource is created one interval
+after the previous one so the newest resources come last.
+"""
+import time
+
+def rfc822(t):
+    """
+    Return RFC 822 date: 'Fri, 17 Jul 2009 01:52:49 +0000'
+
+    @param t timestamp
+    """
+    return time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(t))
+
+class Generator(object):
+    """
+    Synthetic resources generator
+    """
+    def __init__(self, account_sid='AC' + '0' * 32, start=1262304000, interval=1.0):
+        """
+        Class instantiation
+
+        @param account_sid account SID
+        @param start timestamp of the first resource created
+        @param interval number of seconds between two resources
+        """
+        self.account_sid = account_sid
+        self.clock = start
+        self.interval = interval
+        self.count = 0
+
+    def next(self, prefix):
+        """
+        Return next (SID, creation date)
+
+        @param prefix SID prefix: CA, SM...
+        """
+        self.count += 1
+        self.clock += self.interval
+        return '%s%032x' % (prefix, self.count), rfc822(self.clock)
+
+    def resource(self, prefix, uri):
+        """
+        Return fields common to all resources
+        """
+        sid, date = self.next(prefix)
+        return dict(sid=sid, account_sid=self.account_sid, date_created=date,
+                    date_updated=date, api_version='2010-04-01',
+                    uri='/2010-04-01/Accounts/%s/%s/%s.json' % (self.account_sid, uri, sid))
+
+    def account(self, subaccount=False):
+        """
+        Return account resource
+
+        @param subaccount True for a new subaccount, False for the generator
+            account
+        """
+        sid, date = self.next('AC')
+        if not subaccount:
+            sid = self.account_sid
+        return dict(sid=sid, friendly_name='benchmark', status='active',
+                    auth_token='0' * 32, date_created=date, date_updated=date,
+                    uri='/2010-04-01/Accounts/%s.json' % sid)
+
+    def accounts(self, n):
+        """
+        Return n subaccounts, oldest first
+
+        @param n number of subaccounts
+        """
+        return [self.account(True) for i in range(n)]
+
+    def calls(self, n, status='completed'):
+        """
+        Return n calls, oldest first
+
+        @param n number of calls
+        @param status calls status: completed, in-progress...
+        """
+        calls = []
+        for i in range(n):
+            c = self.resource('CA', 'Calls')
+            c.update({'parent_call_sid': None, 'to': '+1415555%04d' % (i % 10000),
+                'from': '+1650555%04d' % (i % 97), 'phone_number_sid': None,
+                'status': status, 'start_time': c['date_created'],
+                'end_time': c['date_created'] if status == 'completed' else None,
+                'duration': '42' if status == 'completed' else None,
+                'price': None, 'direction': 'outbound-api', 'answered_by': None,
+                'forwarded_from': None, 'caller_name': None})
+            calls.append(c)
+        return calls
+
+    def sms_messages(self, n, status='sent'):
+        """
+        Return n SMS messages, oldest first
+
+        @param n number of SMS messages
+        @param status messages status: sent, queued...
+        """
+        messages = []
+        for i in range(n):
+            m = self.resource('SM', 'SMS/Messages')
+            # no date sent until the message is sent
+            m.update({'date_sent': None if status == 'queued' else m['date_created'],
+                'to': '+1415555%04d' % (i % 10000),
+                'from': '+1650555%04d' % (i % 97), 'body': 'benchmark message %d' % i,
+                'status': status, 'direction': 'outbound-api', 'price': '-0.01000'})
+            messages.append(m)
+        return messages
+
+    def recordings(self, calls):
+        """
+        Return one recording per call, oldest first
+
+        @param calls list of calls
+        """
+        recordings = []
+        for c in calls:
+            r = self.resource('RE', 'Recordings')
+            r.update(call_sid=c['sid'], duration='42')
+            recordings.append(r)
+        return recordings
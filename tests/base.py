@@ -0,0 +1,58 @@
+"""
+Test case syncing resources from the fake Twilio API of the benchmarks
+into a temporary SQLite DB
+
+python -m unittest discover tests
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+from twilioresourcesdb import resources
+from fake_twilio import FakeTwilio
+from synthetic import Generator
+
+account_sid = 'AC' + 'c' * 32
+
+class SyncTestCase(unittest.TestCase):
+    """
+    Fake API server, resources generator and temporary SQLite DB
+    """
+    def setUp(self):
+        self.server = FakeTwilio(account_sid)
+        self.g = Generator(account_sid)
+        self.path = tempfile.mkdtemp()
+        self.db_name = os.path.join(self.path, 'test.db')
+
+    def tearDown(self):
+        self.server.close()
+        for engine in resources.connections.values():
+            engine.dispose()
+        resources.connections.clear()
+        shutil.rmtree(self.path)
+
+    def make_resources(self, **settings):
+        """
+        Return Resources object syncing the fake API to the test DB
+
+        @param settings settings added or overridden
+        """
+        s = dict(account_sid=account_sid, account_token='x', api_base_url=self.server.url,
+                 database_type='sqlite', database_name=self.db_name,
+                 retry_base_delay=0, retry_max_delay=0)
+        s.update(settings)
+        r = resources.Resources(s)
+        r.dbg_level = 0
+        return r
+
+    def count(self, r, resource_type):
+        """
+        Return number of rows of a resource type in the DB
+        """
+        return r.session.query(r.resource_classes[resource_type]).count()
@@ -0,0 +1,30 @@
+from base import SyncTestCase, account_sid, resources
+from twilioresourcesdb.coordinator import AccountsCoordinator
+
+class AccountsTest(SyncTestCase):
+    """
+    Accounts list of more than one page
+    """
+    def setUp(self):
+        SyncTestCase.setUp(self)
+        # master account oldest: on the last page
+        self.server.add('accounts', [self.g.account()] + self.g.accounts(120))
+
+    def test_all_pages_stored(self):
+        r = self.make_resources(resource_types=['account', 'call'], page_size=50)
+        self.server.add('calls', self.g.calls(3))
+        r.process()
+        self.assertEqual(self.count(r, 'account'), 121)
+        # 3 pages of accounts, 1 page of calls
+        self.assertEqual(self.server.stats()['requests'], 4)
+        master = r.session.query(resources.Account).filter_by(sid=account_sid).one()
+        self.assertEqual(set(c.accountId for c in r.session.query(resources.Call)), set([master.id]))
+
+    def test_coordinator(self):
+        c = AccountsCoordinator(dict(account_sid=account_sid, account_token='x',
+            api_base_url=self.server.url, database_type='sqlite',
+            database_name=self.db_name, page_size=50), processes=1)
+        self.assertEqual(len(c.get_account_sids()), 121)
+        c.sync_accounts(False)
+        r = self.make_resources(resource_types=['account'])
+        self.assertEqual(self.count(r, 'account'), 121)
@@ -0,0 +1,66 @@
+from base import SyncTestCase
+
+class ActiveTest(SyncTestCase):
+    """
+    Active resources
+    """
+    def test_batch_settles_end_statuses(self):
+        # more active calls than end statuses: batch mode
+        calls = self.g.calls(6, status='in-progress')
+        self.server.add('calls', calls)
+        r = self.make_resources(resource_types=['call'], active_refresh='batch',
+                                active_straggler_age=3600)
+        r.process()
+        self.assertEqual(len(r.list_resources[0]['active']), 6)
+        for c, status in zip(calls, ('completed', 'busy', 'no-answer', 'failed', 'canceled')):
+            self.server.update(c['sid'], status=status)
+        r.process()
+        self.assertEqual(len(r.list_resources[0]['active']), 1)
+        self.assertEqual(self.count(r, 'call'), 5)
+
+    def active_requests(self, active, **settings):
+        """
+        Return number of requests of a sync cycle with active calls created
+        after 1000 completed ones
+        """
+        self.server.add('calls', self.g.calls(1000))
+        self.server.add('calls', self.g.calls(active, status='in-progress'))
+        r = self.make_resources(resource_types=['call'], active_refresh='batch',
+                                active_straggler_age=3600, **settings)
+        r.process()
+        self.assertEqual(len(r.list_resources[0]['active']), active)
+        requests = self.server.stats()['requests']
+        r.process()
+        return self.server.stats()['requests'] - requests
+
+    def test_batch_stops_at_oldest_active(self):
+        # one page per end status, one page of new calls
+        self.assertEqual(self.active_requests(20), 6)
+
+    def test_batch_polls_few_active(self):
+        self.assertEqual(self.active_requests(1), 2)
+
+    def test_spilled_page_queries(self):
+        from sqlalchemy import event
+        r = self.make_resources(resource_types=['call'], active_max_size=10)
+        lr = r.list_resources[0]
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if 'active_resources' in statement:
+                statements.append(statement)
+        event.listen(r.engine, 'before_cursor_execute', count)
+        try:
+            # one query to find the resources spilled, one insert
+            calls = self.g.calls(100, status='in-progress')
+            r.process_page(lr, calls, stop_at_existing=False)
+            r.commit(lr)
+            self.assertEqual(len(lr['active']), 100)
+            self.assertEqual(lr['active'].spilled, 90)
+            self.assertEqual(len(statements), 2)
+            del statements[:]
+            # already active: one query
+            self.assertEqual(r.process_page(lr, calls, stop_at_existing=False), [])
+            self.assertEqual(len(statements), 1)
+            self.assertEqual(len(lr['active']), 100)
+        finally:
+            event.remove(r.engine, 'before_cursor_execute', count)
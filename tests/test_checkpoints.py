@@ -0,0 +1,91 @@
+from base import SyncTestCase
+
+class CheckpointsTest(SyncTestCase):
+    """
+    Sync checkpoints
+    """
+    def test_restart_fetches_delta(self):
+        self.server.add('calls', self.g.calls(300))
+        self.make_resources(resource_types=['call']).process()
+        self.server.add('calls', self.g.calls(10))
+        requests = self.server.stats()['requests']
+        r = self.make_resources(resource_types=['call'])
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 310)
+        self.assertEqual(r.list_resources[0]['items'], 310)
+        self.assertEqual(self.server.stats()['requests'] - requests, 1)
+
+    def test_stop_at_stored_resource(self):
+        for bulk in (False, True):
+            self.server.add('calls', self.g.calls(100))
+            r = self.make_resources(resource_types=['call'], bulk_insert=bulk,
+                                    checkpoints=False)
+            r.process()
+            self.server.add('calls', self.g.calls(10))
+            # items count behind the list, e.g. resources deleted
+            r.list_resources[0]['items'] -= 50
+            requests = self.server.stats()['requests']
+            r.process()
+            self.assertEqual(self.server.stats()['requests'] - requests, 1)
+
+    def fail_page(self, r, failed):
+        """
+        Make a page request of the resources object fail
+        """
+        fetch_page = r.fetch_page
+        def f(lr, page, *args, **kwargs):
+            if page == failed:
+                return None
+            return fetch_page(lr, page, *args, **kwargs)
+        r.fetch_page = f
+
+    def resume_after_failed_page(self, bulk):
+        self.server.add('calls', self.g.calls(300))
+        r = self.make_resources(resource_types=['call'], bulk_insert=bulk)
+        self.fail_page(r, 2)
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 100)
+        self.assertEqual(r.list_resources[0]['items'], 0)
+        r = self.make_resources(resource_types=['call'], bulk_insert=bulk)
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 300)
+        self.assertEqual(r.list_resources[0]['items'], 300)
+
+    def test_resume_after_failed_page(self):
+        self.resume_after_failed_page(False)
+
+    def test_resume_after_failed_page_bulk(self):
+        self.resume_after_failed_page(True)
+
+    def test_resume_incremental_sync(self):
+        self.server.add('calls', self.g.calls(100))
+        self.make_resources(resource_types=['call']).process()
+        self.server.add('calls', self.g.calls(300))
+        r = self.make_resources(resource_types=['call'])
+        self.fail_page(r, 2)
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 200)
+        self.assertEqual(r.list_resources[0]['items'], 100)
+        r = self.make_resources(resource_types=['call'])
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 400)
+        self.assertEqual(r.list_resources[0]['items'], 400)
+
+    def test_resources_added_during_backfill(self):
+        self.server.add('calls', self.g.calls(300))
+        r = self.make_resources(resource_types=['call'])
+        fetch_page = r.fetch_page
+        def f(lr, page, *args, **kwargs):
+            res = fetch_page(lr, page, *args, **kwargs)
+            if page == 0:
+                # next pages shifted by 2
+                self.server.add('calls', self.g.calls(2))
+                r.fetch_page = fetch_page
+            return res
+        r.fetch_page = f
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 300)
+        self.assertEqual(r.list_resources[0]['items'], 300)
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 302)
+        self.assertEqual(r.list_resources[0]['items'], 302)
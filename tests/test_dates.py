@@ -0,0 +1,23 @@
+import unittest
+from datetime import datetime
+
+import base # twilioresourcesdb on sys.path
+from twilioresourcesdb.dates import convert_rfc822_to_datetime
+
+class DatesTest(unittest.TestCase):
+    """
+    RFC 822 dates conversion
+    """
+    def test_twilio_format(self):
+        self.assertEqual(convert_rfc822_to_datetime('Fri, 17 Jul 2009 01:52:49 +0000'),
+                         datetime(2009, 7, 17, 1, 52, 49))
+        self.assertEqual(convert_rfc822_to_datetime('Fri, 17 Jul 2009 03:52:49 +0200'),
+                         datetime(2009, 7, 17, 1, 52, 49))
+
+    def test_other_format(self):
+        self.assertEqual(convert_rfc822_to_datetime('17 Jul 2009 01:52:49 GMT'),
+                         datetime(2009, 7, 17, 1, 52, 49))
+
+    def test_invalid(self):
+        for s in (None, '', 'garbage', 'Fri, 17 Foo 2009 01:52:49 +0000'):
+            self.assertEqual(convert_rfc822_to_datetime(s), None)
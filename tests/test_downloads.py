@@ -0,0 +1,50 @@
+import os
+
+from base import SyncTestCase
+
+class DownloadsTest(SyncTestCase):
+    """
+    Recordings downloads
+    """
+    def setUp(self):
+        SyncTestCase.setUp(self)
+        self.server.recording_size = 1000
+        self.recordings_path = os.path.join(self.path, 'recordings')
+        calls = self.g.calls(40)
+        self.server.add('calls', calls)
+        self.recordings = self.g.recordings(calls)
+        self.server.add('recordings', self.recordings)
+
+    def make_resources(self, **settings):
+        return SyncTestCase.make_resources(self, resource_types=['call', 'recording'],
+            download_recordings=True, recording_path=self.recordings_path,
+            recording_format='wav', **settings)
+
+    def files(self):
+        """
+        Return complete audio files
+        """
+        return set(f for f in os.listdir(self.recordings_path) if not f.endswith('.part'))
+
+    def test_failed_downloads_retried(self):
+        r = self.make_resources(max_attempts=1)
+        self.server.error_rate = 0.3
+        r.process()
+        self.server.error_rate = 0.0
+        r.process()
+        self.assertEqual(self.files(), set(rec['sid'] for rec in self.recordings))
+
+    def test_partial_file_resumed_after_restart(self):
+        r = self.make_resources()
+        r.process()
+        sid = self.recordings[0]['sid']
+        filename = os.path.join(self.recordings_path, sid)
+        os.remove(filename)
+        f = open(filename + '.part', 'wb')
+        f.write('RIFF' + '\0' * 96)
+        f.close()
+        r = self.make_resources()
+        r.process()
+        self.assertEqual(os.path.getsize(filename), 1000)
+        self.assertFalse(os.path.exists(filename + '.part'))
+        self.assertEqual(r.downloader.stats()['files'], 1)
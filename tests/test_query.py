@@ -0,0 +1,20 @@
+from base import SyncTestCase
+from twilioresourcesdb.query import ResourceQuery
+from twilioresourcesdb.resources import TException
+
+class QueryTest(SyncTestCase):
+    """
+    Resources queries
+    """
+    def test_find_status(self):
+        self.server.add('calls', self.g.calls(3))
+        self.server.add('calls', self.g.calls(2, status='in-progress'))
+        r = self.make_resources(resource_types=['call'])
+        r.process()
+        q = ResourceQuery(r)
+        records, cursor = q.find('call', status='completed')
+        self.assertEqual(len(records), 3)
+        self.assertEqual(cursor, None)
+        # no status column
+        self.assertRaises(TException, q.find, 'recording', status='completed')
+        self.assertRaises(TException, q.find, 'notification', status='completed')
@@ -0,0 +1,90 @@
+import unittest
+
+import base # twilioresourcesdb on sys.path
+from twilioresourcesdb import ratelimit
+from twilioresourcesdb.ratelimit import TokenBucket, RetryPolicy
+
+class Clock(object):
+    """
+    Time module replacement: sleeping moves the clock forward
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class TokenBucketTest(unittest.TestCase):
+    """
+    Token bucket rate limiter
+    """
+    def setUp(self):
+        self.time = ratelimit.time
+        self.clock = ratelimit.time = Clock()
+
+    def tearDown(self):
+        ratelimit.time = self.time
+
+    def test_burst(self):
+        bucket = TokenBucket(8, burst=4)
+        self.assertEqual([bucket.acquire() for i in range(4)], [0.0] * 4)
+        # bucket empty: wait for a token
+        self.assertEqual(bucket.acquire(), 0.125)
+        self.assertEqual(self.clock.now, 1000.125)
+
+    def test_rate(self):
+        bucket = TokenBucket(8)
+        for i in range(24):
+            bucket.acquire()
+        # 8 tokens at first, then 8 per second
+        self.assertEqual(self.clock.now, 1002.0)
+
+    def test_refill(self):
+        bucket = TokenBucket(2, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        # idle: tokens added up to the burst
+        self.clock.now += 60
+        self.assertEqual([bucket.acquire() for i in range(2)], [0.0] * 2)
+        self.assertEqual(bucket.acquire(), 0.5)
+
+class RetryPolicyTest(unittest.TestCase):
+    """
+    Retry policy
+    """
+    def test_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+        self.assertTrue(policy.retry(1))
+        self.assertTrue(policy.retry(2, 503))
+        self.assertFalse(policy.retry(3, 503))
+        self.assertFalse(policy.retry(3))
+
+    def test_statuses(self):
+        policy = RetryPolicy()
+        for status in (429, 500, 502, 503, 504):
+            self.assertTrue(policy.retry(1, status))
+        for status in (400, 401, 404):
+            self.assertFalse(policy.retry(1, status))
+
+    def test_backoff_bounds(self):
+        policy = RetryPolicy(base_delay=0.5, max_delay=3)
+        for attempt, bound in ((1, 0.5), (2, 1), (3, 2), (4, 3), (10, 3)):
+            delays = [policy.delay(attempt) for i in range(200)]
+            self.assertTrue(min(delays) >= 0)
+            self.assertTrue(max(delays) <= bound)
+            # jitter
+            self.assertTrue(max(delays) > bound / 2)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(base_delay=0.5, max_delay=30)
+        self.assertEqual(policy.delay(1, '2'), 2)
+        self.assertEqual(policy.delay(1, '0'), 0)
+        self.assertEqual(policy.delay(1, '-5'), 0)
+        # capped
+        self.assertEqual(policy.delay(1, '3600'), 30)
+        # HTTP date: backoff
+        delay = policy.delay(1, 'Fri, 17 Jul 2009 01:52:49 GMT')
+        self.assertTrue(0 <= delay <= 0.5)
@@ -0,0 +1,15 @@
+from base import SyncTestCase, resources
+
+class SqliteTest(SyncTestCase):
+    """
+    SQLite backend
+    """
+    def test_memory_workers_rejected(self):
+        self.assertRaises(resources.TException, self.make_resources,
+                          database_name=':memory:', workers=4)
+
+    def test_memory(self):
+        r = self.make_resources(database_name=':memory:')
+        self.server.add('calls', self.g.calls(120))
+        r.process()
+        self.assertEqual(self.count(r, 'call'), 120)
@@ -0,0 +1,24 @@
+from base import SyncTestCase
+
+class WatermarkTest(SyncTestCase):
+    """
+    Watermark sync mode
+    """
+    def test_queued_sms_stored_once_sent(self):
+        r = self.make_resources(resource_types=['sms_message'], sync_mode='watermark')
+        self.server.add('sms_messages', self.g.sms_messages(3))
+        # first sync: count mode, sets the watermark
+        r.process()
+        # queued: no DateSent, not listed
+        queued = self.g.sms_messages(1, status='queued')[0]
+        self.server.add('sms_messages', [queued])
+        self.server.add('sms_messages', self.g.sms_messages(1))
+        r.process()
+        self.assertEqual(self.count(r, 'sms_message'), 4)
+        # sent after a newer message
+        self.server.update(queued['sid'], status='sent', date_sent=queued['date_created'])
+        r.process()
+        self.assertEqual(self.count(r, 'sms_message'), 5)
+        r.process()
+        self.assertEqual(self.count(r, 'sms_message'), 5)
+        self.assertEqual(r.list_resources[0]['items'], 5)
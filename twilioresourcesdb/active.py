@@ -0,0 +1,405 @@
+import time
+
+class ActiveSet(object):
+    """
+    Active resources of one type (queued, ringing, in-progress...): SID ->
+    (first seen time, creation time, last status). Up to max_size
+    resources are kept in memory and polled at each cycle, the others
+    are spilled over to the DB and polled when their next poll time is
+    due, every spill_interval seconds. Resources active for longer than
+    max_age seconds are expired.
+    """
+    def __init__(self, resource_type, max_size=0, max_age=0, spill=None, spill_interval=300):
+        """
+        Class instantiation
+
+        @param resource_type type of resource: call, sms_message...
+        @param max_size number of resources kept in memory, 0 for no limit
+        @param max_age number of seconds after which a resource still active
+            is expired, 0 to keep it forever
+        @param spill SqlActiveSpill or RedisActiveSpill, None to keep all the
+            resources in memory
+        @param spill_interval number of seconds between two polls of a
+            spilled resource
+        """
+        self.type = resource_type
+        self.max_size = max_size
+        self.max_age = max_age
+        self.spill = spill
+        self.spill_interval = spill_interval
+        # SID -> (first seen, created, status)
+        self.entries = {}
+        # number of resources spilled over
+        self.spilled = spill.count() if spill else 0
+
+    def __len__(self):
+        return len(self.entries) + self.spilled
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def find(self, sids):
+        """
+        Return the SIDs active: one query for the spilled ones
+
+        @param sids list of SIDs
+        @return set of SIDs
+        """
+        found = set(sid for sid in sids if sid in self.entries)
+        found.update(self.find_spilled([sid for sid in sids if not sid in found]))
+        return found
+
+    def find_spilled(self, sids):
+        """
+        Return the SIDs spilled over: one query
+
+        @param sids list of SIDs
+        @return set of SIDs
+        """
+        if not self.spilled or not sids:
+            return set()
+        return self.spill.get(sids)
+
+    def add(self, resources):
+        """
+        Add active resources, the ones not fitting in memory are spilled
+        over at once: one query (or Redis round trip) to find the ones
+        already spilled, one to spill the others
+
+        @param resources list of (SID, status, creation timestamp or None,
+            first seen timestamp or None for now)
+        """
+        now = time.time()
+        spilled = self.find_spilled([r[0] for r in resources if not r[0] in self.entries])
+        spill = []
+        for sid, status, created, first_seen in resources:
+            if first_seen is None:
+                first_seen = now
+            entry = self.entries.get(sid)
+            if entry:
+                self.entries[sid] = (entry[0], entry[1], status)
+            elif sid in spilled:
+                self.spill.update(sid, status, now + self.spill_interval)
+            elif not self.spill or not self.max_size or len(self.entries) < self.max_size:
+                self.entries[sid] = (first_seen, created, status)
+            else:
+                spill.append((sid, first_seen, created, status))
+        if spill:
+            self.spilled += self.spill.add(spill, now + self.spill_interval)
+
+    def update(self, sid, status):
+        """
+        Set the last status of a resource polled still active: spilled
+        resources are polled again in spill_interval seconds
+
+        @param sid resource SID
+        @param status resource status
+        """
+        entry = self.entries.get(sid)
+        if entry:
+            self.entries[sid] = (entry[0], entry[1], status)
+        elif self.spilled:
+            self.spill.update(sid, status, time.time() + self.spill_interval)
+
+    def remove(self, sid):
+        """
+        Remove resource completed or expired
+
+        @param sid resource SID
+        """
+        if self.entries.pop(sid, None) is None and self.spilled:
+            if self.spill.remove(sid):
+                self.spilled -= 1
+
+    def due(self, now=None):
+        """
+        Return the resources to poll: the ones in memory and the spilled
+        ones due, up to max_size
+
+        @param now timestamp
+        @return list of (SID, first seen, created, status)
+        """
+        if now is None:
+            now = time.time()
+        due = [(sid,) + entry for sid, entry in self.entries.items()]
+        if self.spilled:
+            due.extend(self.spill.due(now, self.max_size or 1000))
+        return due
+
+    def expire(self, now=None):
+        """
+        Remove the resources active for longer than max_age seconds
+
+        @param now timestamp
+        @return (SIDs expired in memory, number of spilled resources expired)
+        """
+        if not self.max_age:
+            return [], 0
+        if now is None:
+            now = time.time()
+        cutoff = now - self.max_age
+        expired = [sid for sid, entry in self.entries.items() if entry[0] < cutoff]
+        for sid in expired:
+            del self.entries[sid]
+        spilled = 0
+        if self.spilled:
+            spilled = self.spill.expire(cutoff)
+            self.spilled -= spilled
+        return expired, spilled
+
+    def refill(self):
+        """
+        Move spilled resources back to memory while there is room, next
+        poll first
+        """
+        room = self.max_size - len(self.entries)
+        if not self.spilled or room <= 0:
+            return
+        for sid, first_seen, created, status in self.spill.take(room):
+            self.entries[sid] = (first_seen, created, status)
+            self.spilled -= 1
+
+    def oldest(self):
+        """
+        Return the oldest creation time (first seen time if unknown) of
+        the resources, None if there are none
+        """
+        times = [created or first_seen for first_seen, created, status in self.entries.values()]
+        if self.spilled:
+            times.append(self.spill.oldest())
+        times = [t for t in times if t]
+        return min(times) if times else None
+
+    def dump(self):
+        """
+        Return the resources in memory for the sync checkpoint, the
+        spilled ones are already in the DB
+
+        @return list of [SID, first seen, created, status]
+        """
+        return [[sid] + list(entry) for sid, entry in self.entries.items()]
+
+    def clear(self):
+        """
+        Remove all the resources, spilled ones included
+        """
+        self.entries.clear()
+        if self.spill:
+            self.spill.clear()
+        self.spilled = 0
+
+class SqlActiveSpill(object):
+    """
+    Active resources spilled over to the active_resources table, next poll
+    time indexed. Changes are written in the Resources session: committed
+    with the resources.
+    """
+    def __init__(self, session, table, account_sid, resource_type):
+        """
+        Class instantiation
+
+        @param session SQLAlchemy session
+        @param table active_resources table
+        @param account_sid account SID
+        @param resource_type type of resource: call, sms_message...
+        """
+        from sqlalchemy import and_
+        self.session = session
+        self.table = table
+        self.account_sid = account_sid
+        self.resource_type = resource_type
+        self.where = and_(table.c.accountSid == account_sid,
+                          table.c.resourceType == resource_type)
+
+    def count(self):
+        from sqlalchemy import select, func
+        return self.session.execute(select([func.count()]).where(self.where)).scalar()
+
+    def add(self, entries, next_poll):
+        """
+        @param entries list of (SID, first seen, created, status)
+        @param next_poll next poll timestamp
+        @return number of resources added, the ones already spilled are
+            skipped
+        """
+        existing = self.get([e[0] for e in entries])
+        rows = [dict(accountSid=self.account_sid, resourceType=self.resource_type,
+                     sid=sid, firstSeen=first_seen, created=created, status=status,
+                     nextPoll=next_poll)
+                for sid, first_seen, created, status in entries if not sid in existing]
+        if rows:
+            self.session.execute(self.table.insert(), rows)
+        return len(rows)
+
+    def get(self, sids):
+        """
+        @return set of the SIDs spilled
+        """
+        from sqlalchemy import select
+        if not sids:
+            return set()
+        c = self.table.c
+        return set(row[0] for row in self.session.execute(
+            select([c.sid]).where(c.sid.in_(sids))))
+
+    def update(self, sid, status, next_poll):
+        c = self.table.c
+        self.session.execute(self.table.update().where(c.sid == sid),
+                             dict(status=status, nextPoll=next_poll))
+
+    def remove(self, sid):
+        """
+        @return True if the resource was spilled
+        """
+        c = self.table.c
+        return self.session.execute(self.table.delete().where(c.sid == sid)).rowcount > 0
+
+    def due(self, now, limit):
+        """
+        @return list of (SID, first seen, created, status), next poll first
+        """
+        from sqlalchemy import select, and_
+        c = self.table.c
+        return [tuple(row) for row in self.session.execute(
+            select([c.sid, c.firstSeen, c.created, c.status])
+            .where(and_(self.where, c.nextPoll <= now))
+            .order_by(c.nextPoll).limit(limit))]
+
+    def take(self, limit):
+        """
+        Remove and return resources, next poll first
+
+        @return list of (SID, first seen, created, status)
+        """
+        from sqlalchemy import select
+        c = self.table.c
+        entries = [tuple(row) for row in self.session.execute(
+            select([c.sid, c.firstSeen, c.created, c.status])
+            .where(self.where).order_by(c.nextPoll).limit(limit))]
+        if entries:
+            self.session.execute(self.table.delete().where(c.sid.in_([e[0] for e in entries])))
+        return entries
+
+    def expire(self, cutoff):
+        """
+        Remove the resources first seen before cutoff
+
+        @return number of resources removed
+        """
+        from sqlalchemy import and_
+        c = self.table.c
+        return self.session.execute(self.table.delete().where(
+            and_(self.where, c.firstSeen < cutoff))).rowcount
+
+    def oldest(self):
+        from sqlalchemy import select, func
+        c = self.table.c
+        return self.session.execute(select([func.min(func.coalesce(c.created, c.firstSeen))])
+                                   .where(self.where)).scalar()
+
+    def clear(self):
+        self.session.execute(self.table.delete().where(self.where))
+
+class RedisActiveSpill(object):
+    """
+    Active resources spilled over to Redis: sorted set of the SIDs scored
+    by next poll time (active:<account SID>:<resource type>), sorted set
+    scored by first seen time (...:seen) and hash SID -> 'first seen
+    created status' (...:entries)
+    """
+    def __init__(self, redis, account_sid, resource_type):
+        """
+        Class instantiation
+
+        @param redis Redis client
+        @param account_sid account SID
+        @param resource_type type of resource: call, sms_message...
+        """
+        self.redis = redis
+        self.key = 'active:%s:%s' % (account_sid, resource_type)
+        self.seen_key = self.key + ':seen'
+        self.entries_key = self.key + ':entries'
+
+    def count(self):
+        return self.redis.zcard(self.key)
+
+    def add(self, entries, next_poll):
+        """
+        @return number of resources added, one round trip
+        """
+        pipe = self.redis.pipeline()
+        for sid, first_seen, created, status in entries:
+            pipe.zadd(self.key, {sid: next_poll})
+            pipe.zadd(self.seen_key, {sid: first_seen})
+            pipe.hset(self.entries_key, sid, '%f %s %s' % (first_seen, created or '-', status))
+        return sum(pipe.execute()[::3])
+
+    def get(self, sids):
+        if not sids:
+            return set()
+        return set(sid for sid, v in zip(sids, self.redis.hmget(self.entries_key, sids)) if v)
+
+    def update(self, sid, status, next_poll):
+        v = self.redis.hget(self.entries_key, sid)
+        if not v:
+            return
+        first_seen, created, old = v.split(' ', 2)
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.key, {sid: next_poll}, xx=True)
+        pipe.hset(self.entries_key, sid, '%s %s %s' % (first_seen, created, status))
+        pipe.execute()
+
+    def remove(self, sid):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.key, sid)
+        pipe.zrem(self.seen_key, sid)
+        pipe.hdel(self.entries_key, sid)
+        return pipe.execute()[0] == 1
+
+    def entries(self, sids):
+        """
+        @return list of (SID, first seen, created, status)
+        """
+        if not sids:
+            return []
+        entries = []
+        for sid, v in zip(sids, self.redis.hmget(self.entries_key, sids)):
+            if v:
+                first_seen, created, status = v.split(' ', 2)
+                entries.append((sid, float(first_seen),
+                                None if created == '-' else float(created), status))
+        return entries
+
+    def due(self, now, limit):
+        return self.entries(self.redis.zrangebyscore(self.key, '-inf', now, start=0, num=limit))
+
+    def take(self, limit):
+        entries = self.entries(self.redis.zrange(self.key, 0, limit - 1))
+        if entries:
+            sids = [e[0] for e in entries]
+            pipe = self.redis.pipeline()
+            pipe.zrem(self.key, *sids)
+            pipe.zrem(self.seen_key, *sids)
+            pipe.hdel(self.entries_key, *sids)
+            pipe.execute()
+        return entries
+
+    def expire(self, cutoff):
+        sids = self.redis.zrangebyscore(self.seen_key, '-inf', '(%f' % cutoff)
+        if not sids:
+            return 0
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.key, *sids)
+        pipe.zrem(self.seen_key, *sids)
+        pipe.hdel(self.entries_key, *sids)
+        return pipe.execute()[0]
+
+    def oldest(self):
+        """
+        Redis: oldest first seen time
+        """
+        first = self.redis.zrange(self.seen_key, 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    def clear(self):
+        self.redis.delete(self.key, self.seen_key, self.entries_key)
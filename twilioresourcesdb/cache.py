@@ -0,0 +1,80 @@
+from threading import Lock
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    Bounded least recently used cache
+    """
+    def __init__(self, size):
+        """
+        Class instantiation
+
+        @param size maximum number of items kept
+        """
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """
+        Get item and mark it as most recently used
+
+        @param key item key
+        @param default value returned if key is not cached
+        @return cached value or default
+        """
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Add item, evict least recently used item if cache is full
+
+        @param key item key
+        @param value item value
+        """
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def __contains__(self, key):
+        """
+        Check if key is cached without updating stats or usage order
+
+        @param key item key
+        """
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        """
+        Remove all items
+        """
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        """
+        Cache statistics
+
+        @return dict: size, items, hits, misses, hit_ratio
+        """
+        total = self.hits + self.misses
+        return dict(size=self.size, items=len(self.items), hits=self.hits,
+                    misses=self.misses,
+                    hit_ratio=float(self.hits) / total if total else 0.0)
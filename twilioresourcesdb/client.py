@@ -0,0 +1,307 @@
+import base64
+import httplib
+import socket
+import time
+import zlib
+from threading import BoundedSemaphore, Lock
+from urlparse import urlparse
+import Queue
+
+from ratelimit import RetryPolicy
+
+class HTTPError(Exception):
+    """
+    HTTP error response
+    """
+    def __init__(self, status, reason, body='', headers=None):
+        """
+        Class instantiation
+
+        @param status HTTP status code
+        @param reason HTTP reason phrase
+        @param body response body
+        @param headers dict of response headers
+        """
+        Exception.__init__(self, '%d %s' % (status, reason))
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.headers = headers or {}
+
+class StreamedResponse(object):
+    """
+    Response body read incrementally, gzip decoded. The connection goes
+    back to the pool when the body is read entirely or the response is
+    closed.
+    """
+    def __init__(self, client, conn, response, chunk_size=65536):
+        """
+        Class instantiation
+
+        @param client HTTPClient
+        @param conn connection
+        @param response HTTP response
+        @param chunk_size number of bytes read from the connection at once
+        """
+        self.client = client
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.chunk_size = chunk_size
+        self.decompressor = None
+        if response.getheader('content-encoding') == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # bytes received
+        self.bytes = 0
+        self.done = False
+
+    def read(self, size=-1):
+        """
+        Read body
+
+        @param size number of bytes read from the connection, -1 for all
+        @return decoded data, '' at the end of the body
+        """
+        if self.done or size == 0:
+            return ''
+        if size < 0:
+            return ''.join(iter(lambda: self.read(self.chunk_size), ''))
+        while True:
+            try:
+                data = self.response.read(size)
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                raise
+            self.bytes += len(data)
+            if not data:
+                self.done = True
+                rest = self.decompressor.flush() if self.decompressor else ''
+                self.close()
+                return rest
+            if self.decompressor:
+                data = self.decompressor.decompress(data)
+                if not data:
+                    continue
+            return data
+
+    def close(self):
+        """
+        Release the connection, closed if the body was not read entirely
+        """
+        if self.conn is not None:
+            self.client.release_connection(self.conn, self.done and not self.response.will_close)
+            self.conn = None
+
+class HTTPClient(object):
+    """
+    Thread safe HTTP client keeping a pool of keep-alive connections
+    """
+    def __init__(self, base_url, username, password, pool_size=4, timeout=30,
+                 rate_limiter=None, retry_policy=None):
+        """
+        Class instantiation
+
+        @param base_url server URL: 'https://api.twilio.com'
+        @param username basic authentication username
+        @param password basic authentication password
+        @param pool_size maximum number of connections opened
+        @param timeout socket timeout in seconds
+        @param rate_limiter TokenBucket shared by all requests, None for no limit
+        @param retry_policy RetryPolicy for 429/5xx responses and connection
+            errors (default: RetryPolicy())
+        """
+        u = urlparse(base_url)
+        self.scheme = u.scheme
+        self.host = u.hostname
+        self.port = u.port
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.auth = 'Basic ' + base64.b64encode('%s:%s' % (username, password))
+        # idle connections, most recently used first
+        self.pool = Queue.LifoQueue()
+        self.slots = BoundedSemaphore(pool_size)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.lock = Lock()
+        self.counters = dict(requests=0, throttled=0, retried=0, failed=0,
+                             rate_limited_seconds=0.0)
+
+    def connect(self):
+        """
+        Open new connection
+
+        @return HTTP(S) connection
+        """
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def get_connection(self):
+        """
+        Get idle connection from the pool or open a new one. Blocks if
+        pool_size connections are in use.
+
+        @return (connection, reused)
+        """
+        self.slots.acquire()
+        try:
+            return self.pool.get_nowait(), True
+        except Queue.Empty:
+            return self.connect(), False
+
+    def release_connection(self, conn, reuse=True):
+        """
+        Return connection to the pool
+
+        @param conn connection
+        @param reuse False to close the connection
+        """
+        if reuse:
+            self.pool.put(conn)
+        else:
+            conn.close()
+        self.slots.release()
+
+    def request(self, path, method='GET', headers=None):
+        """
+        Send request and return response body, gzip decoded. 429/5xx
+        responses and connection errors are retried following the retry
+        policy.
+
+        @param path request path and query string
+        @param method HTTP method
+        @param headers dict of extra request headers
+        @return response body
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                conn, response = self.open(path, method, headers)
+                try:
+                    body = response.read()
+                except (httplib.HTTPException, socket.error):
+                    self.release_connection(conn, False)
+                    raise
+            except (httplib.HTTPException, socket.error):
+                if not self.retry_policy.retry(attempt):
+                    self.count('failed')
+                    raise
+                self.count('retried')
+                time.sleep(self.retry_policy.delay(attempt))
+                continue
+            self.release_connection(conn, not response.will_close)
+            if response.getheader('content-encoding') == 'gzip':
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            if response.status >= 400:
+                if response.status == 429:
+                    self.count('throttled')
+                if self.retry_policy.retry(attempt, response.status):
+                    self.count('retried')
+                    time.sleep(self.retry_policy.delay(attempt,
+                        response.getheader('retry-after')))
+                    continue
+                self.count('failed')
+                raise HTTPError(response.status, response.reason, body,
+                                dict(response.getheaders()))
+            return body
+
+    def stream(self, path, method='GET', headers=None):
+        """
+        Send request and return the response body to be read
+        incrementally. 429/5xx responses and connection errors are
+        retried following the retry policy until the body is streamed.
+
+        @param path request path and query string
+        @param method HTTP method
+        @param headers dict of extra request headers
+        @return StreamedResponse, the caller must read it or close it
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                conn, response = self.open(path, method, headers)
+            except (httplib.HTTPException, socket.error):
+                if not self.retry_policy.retry(attempt):
+                    self.count('failed')
+                    raise
+                self.count('retried')
+                time.sleep(self.retry_policy.delay(attempt))
+                continue
+            streamed = StreamedResponse(self, conn, response)
+            if response.status < 400:
+                return streamed
+            body = streamed.read()
+            if response.status == 429:
+                self.count('throttled')
+            if self.retry_policy.retry(attempt, response.status):
+                self.count('retried')
+                time.sleep(self.retry_policy.delay(attempt,
+                    response.getheader('retry-after')))
+                continue
+            self.count('failed')
+            raise HTTPError(response.status, response.reason, body,
+                            dict(response.getheaders()))
+
+    def open(self, path, method='GET', headers=None):
+        """
+        Send request and return the response without reading its body so
+        it can be streamed. The caller must read the response and then
+        call release_connection(conn, not response.will_close).
+
+        @param path request path and query string
+        @param method HTTP method
+        @param headers dict of extra request headers
+        @return (connection, response)
+        """
+        h = {'Authorization': self.auth, 'Accept-Encoding': 'gzip',
+             'Connection': 'keep-alive'}
+        if headers:
+            h.update(headers)
+        if self.rate_limiter:
+            waited = self.rate_limiter.acquire()
+            if waited:
+                self.count('rate_limited_seconds', waited)
+        self.count('requests')
+        while True:
+            conn, reused = self.get_connection()
+            try:
+                conn.request(method, path, headers=h)
+                return conn, conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                self.release_connection(conn, False)
+                # the server may have closed an idle connection: retry
+                # once with a new one
+                if not reused:
+                    raise
+
+    def count(self, counter, value=1):
+        """
+        Increment counter
+
+        @param counter counter name
+        @param value increment
+        """
+        with self.lock:
+            self.counters[counter] += value
+
+    def stats(self):
+        """
+        Requests statistics
+
+        @return dict: requests, throttled (429 responses), retried, failed,
+            rate_limited_seconds (time waiting for the rate limiter)
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def close(self):
+        """
+        Close idle connections
+        """
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Queue.Empty:
+                break
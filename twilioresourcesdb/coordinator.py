@@ -0,0 +1,269 @@
+import time
+import Queue
+import multiprocessing
+
+import simplejson
+
+from client import HTTPClient
+from resources import Resources, TException, connections, logger, resource_classes
+
+def account_settings(settings, account_sid):
+    """
+    Return Resources settings of a subaccount: requests authenticated
+    with the master account credentials, tables already created
+
+    @param settings coordinator settings
+    @param account_sid subaccount SID
+    """
+    s = dict(settings, account_sid=account_sid, assume_schema=True,
+             auth_sid=settings.get('auth_sid', settings['account_sid']),
+             # the accounts list is synced once by the coordinator
+             resource_types=[t for t in settings.get('resource_types') or resource_classes
+                             if t != 'account'])
+    # one metrics server per process at most: not per account
+    s.pop('metrics_port', None)
+    return s
+
+def count_inserted(r):
+    """
+    Return number of rows inserted so far by a Resources object
+    """
+    return sum(r.metrics.snapshot()['counters'].get('rows_inserted_total', {}).values())
+
+def sync_account(settings, account_sid, resources, loop, report):
+    """
+    Sync one account: one download or one step of the continuous mode.
+    The account Resources object is kept in resources between steps.
+
+    @param settings coordinator settings
+    @param account_sid account SID
+    @param resources dict account SID -> Resources
+    @param loop continuous mode
+    @param report function called with the progress info
+    @return number of seconds until the account is due again
+    """
+    start = time.time()
+    delay = settings.get('max_check_interval', 300)
+    info = dict(account_sid=account_sid)
+    try:
+        r = resources.get(account_sid)
+        if r is None:
+            r = resources[account_sid] = Resources(account_settings(settings, account_sid))
+            r.cycles = 0
+        inserted = count_inserted(r)
+        if loop:
+            next_due = r.process_due()
+            if next_due is not None:
+                delay = next_due
+        else:
+            r.process()
+        r.cycles += 1
+        info.update(status='synced', cycle=r.cycles,
+                    items=sum(lr['items'] for lr in r.list_resources),
+                    inserted=count_inserted(r) - inserted,
+                    active=sum(len(lr['active']) for lr in r.list_resources))
+        if not loop:
+            del resources[account_sid]
+            r.client.close()
+            if r.sql:
+                r.session.remove()
+    except Exception, e:
+        info.update(status='failed', error='%s' % e)
+    info['seconds'] = time.time() - start
+    report(info)
+    return delay
+
+def sync_shard(settings, account_sids, loop, report, stop):
+    """
+    Sync accounts one after the other in this process: once, or
+    continuously, each account being synced when one of its resource
+    types is due.
+
+    @param settings coordinator settings
+    @param account_sids list of account SIDs
+    @param loop continuous mode
+    @param report function called with the progress info of each account sync
+    @param stop Event set to stop
+    """
+    resources = {}
+    # account SID -> time the account is due
+    due = dict((sid, 0) for sid in account_sids)
+    while not stop.is_set():
+        for account_sid in account_sids:
+            if stop.is_set():
+                break
+            if due[account_sid] <= time.time():
+                due[account_sid] = time.time() + sync_account(settings, account_sid,
+                                                              resources, loop, report)
+        if not loop:
+            break
+        stop.wait(max(0, min(due.values()) - time.time()))
+
+def run_shard(settings, account_sids, loop, queue, stop):
+    """
+    Worker process: sync accounts, progress info put in queue followed
+    by None when done
+    """
+    # do not reuse the connections inherited from the parent process
+    connections.clear()
+    try:
+        sync_shard(settings, account_sids, loop, queue.put, stop)
+    finally:
+        queue.put(None)
+
+class AccountsCoordinator(object):
+    """
+    Sync many accounts (the subaccounts of a master account) into the same
+    DB. The accounts are sharded across worker processes, each process
+    syncs its accounts one after the other with the master account
+    credentials and a DB connection pool shared by its accounts. Progress
+    is reported per account in this process.
+    """
+    def __init__(self, settings, account_sids=None, processes=None, progress=None):
+        """
+        Class instantiation
+
+        @param settings Resources settings: account_sid and account_token
+            are the master account credentials
+        @param account_sids list of account SIDs to sync, None for the master
+            account and its subaccounts not closed (Accounts.json)
+        @param processes number of worker processes (default: number of CPUs)
+        @param progress function called after each account sync with a dict:
+            account_sid, status ('synced' or 'failed'), cycle, items (resources
+            synced so far), inserted (rows inserted during the sync), active,
+            seconds, error (default: log)
+        """
+        if not 'account_sid' in settings:
+            raise TException("Twilio account SID is required")
+        if not 'account_token' in settings:
+            raise TException("Twilio account token is required")
+        self.settings = settings
+        self.account_sids = account_sids
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.progress = progress or self.log_progress
+        # account SID -> last progress info
+        self.accounts = {}
+        # number of accounts synced by run
+        self.total = 0
+        self.stop_event = multiprocessing.Event()
+
+    def get_account_sids(self):
+        """
+        List the accounts with the master account credentials
+
+        @return list of account SIDs, closed accounts excluded
+        """
+        client = HTTPClient(self.settings.get('api_base_url', 'https://api.twilio.com'),
+            self.settings.get('auth_sid', self.settings['account_sid']),
+            self.settings['account_token'], 1, self.settings.get('http_timeout', 30))
+        account_sids = []
+        page = 0
+        try:
+            while True:
+                data = client.request('/2010-04-01/Accounts.json?PageSize=%d&Page=%d'
+                                      % (self.settings.get('page_size', 50), page))
+                res = simplejson.loads(data)
+                for account in res['accounts']:
+                    if account.get('status') != 'closed':
+                        account_sids.append(account['sid'])
+                if res.get('next_page_uri') == None:
+                    break
+                page += 1
+        except Exception, e:
+            raise TException("Accounts list failed: %s" % e)
+        finally:
+            client.close()
+        return account_sids
+
+    def sync_accounts(self, fork):
+        """
+        Create or migrate the tables and sync the accounts list once,
+        before the workers start: the accounts are the parents of the
+        resources synced by the workers
+
+        @param fork worker processes started next: close the connections
+        """
+        r = Resources(dict(self.settings, resource_types=['account'],
+                           download_recordings=False, metrics_port=None))
+        r.process()
+        r.client.close()
+        if not r.sql:
+            return
+        r.session.remove()
+        if fork:
+            # the worker processes open their own connections
+            r.engine.dispose()
+            connections.clear()
+
+    def run(self, loop=False):
+        """
+        Sync the accounts: once, or continuously until stop() is called
+
+        @param loop continuous mode
+        @return dict account SID -> last progress info
+        """
+        if self.account_sids is None:
+            account_sids = self.get_account_sids()
+        else:
+            account_sids = list(self.account_sids)
+        self.total = len(account_sids)
+        if not account_sids:
+            return self.accounts
+        processes = max(1, min(self.processes, len(account_sids)))
+        if (processes > 1 and self.settings.get('database_type') == 'sqlite'
+                and self.settings.get('database_name') == ':memory:'):
+            raise TException("An in-memory SQLite DB can not be shared by processes")
+        self.sync_accounts(processes > 1)
+        if processes == 1:
+            sync_shard(self.settings, account_sids, loop, self.report, self.stop_event)
+            return self.accounts
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_shard, args=(self.settings,
+            account_sids[i::processes], loop, queue, self.stop_event))
+            for i in range(processes)]
+        for w in workers:
+            w.start()
+        running = len(workers)
+        while running:
+            try:
+                info = queue.get(timeout=1)
+            except Queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    # workers killed
+                    break
+                continue
+            if info is None:
+                running -= 1
+            else:
+                self.report(info)
+        for w in workers:
+            w.join()
+        return self.accounts
+
+    def stop(self):
+        """
+        Stop the workers after their current account sync
+        """
+        self.stop_event.set()
+
+    def report(self, info):
+        """
+        Record and report account progress
+
+        @param info progress info
+        """
+        self.accounts[info['account_sid']] = info
+        self.progress(info)
+
+    def log_progress(self, info):
+        """
+        Log account progress
+        """
+        if info['status'] == 'failed':
+            logger.error('%s: sync failed: %s', info['account_sid'], info['error'])
+        else:
+            logger.info('%s: cycle %d, %d resources, %d inserted, %d active, %.1fs (%d/%d accounts synced)',
+                info['account_sid'], info['cycle'], info['items'], info['inserted'],
+                info['active'], info['seconds'], len(self.accounts), self.total)
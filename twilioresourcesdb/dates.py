@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+from email.utils import parsedate, parsedate_tz
+
+months = dict((m, i + 1) for i, m in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')))
+# RFC 822 date -> datetime, pages share many identical dates
+date_cache = {}
+date_cache_size = 4096
+# query cursors and Redis index dates: sorts like the dates
+sortable_date_format = '%Y-%m-%dT%H:%M:%S'
+
+def convert_rfc822_to_datetime(str):
+    """
+    Convert Twilio RFC 822 date to UTC datetime
+
+    'Fri, 17 Jul 2009 01:52:49 +0000' -> datetime(2009, 7, 17, 1, 52, 49)
+    @param str RFC 822 date string
+    @returns datetime or None if str is None, empty or not a date
+    """
+    if not str:
+        return None
+    d = date_cache.get(str)
+    if d is None:
+        try:
+            wday, day, month, year, t, tz = str.split(' ')
+            d = datetime(int(year), months[month], int(day),
+                         int(t[0:2]), int(t[3:5]), int(t[6:8]))
+            if tz != '+0000':
+                offset = int(tz[1:3]) * 60 + int(tz[3:5])
+                d -= timedelta(minutes=offset if tz[0] == '+' else -offset)
+        except (ValueError, KeyError):
+            # not the Twilio format
+            t = parsedate_tz(str)
+            if t is None:
+                return None
+            d = datetime(*t[:6]) - timedelta(seconds=t[9] or 0)
+        if len(date_cache) >= date_cache_size:
+            date_cache.clear()
+        date_cache[str] = d
+    return d
+
+def convert_rfc822_to_mysql_datetime(str):
+    """
+    Convert RFC 822 date to MySQL datetime
+
+    'Fri, 17 Jul 2009 01:52:49 +0000' -> '2009-07-17 01:52:49'
+    @param str RFC 822 date string
+    @returns MySQL date string
+    """
+    d = parsedate(str)
+    return '%d-%d-%d %02d:%02d:%02d' % (d[0], d[1], d[2], d[3], d[4], d[5])
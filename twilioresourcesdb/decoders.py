@@ -0,0 +1,194 @@
+import importlib
+import json
+
+import simplejson
+
+class SimplejsonDecoder(object):
+    """
+    simplejson decoder
+    """
+    name = 'simplejson'
+
+    def loads(self, data):
+        """
+        Decode JSON document
+
+        @param data JSON string
+        @return decoded object
+        """
+        return simplejson.loads(data)
+
+class JsonDecoder(object):
+    """
+    Standard library json decoder
+    """
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+class UjsonDecoder(object):
+    """
+    ujson decoder (requires ujson)
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        """
+        Class instantiation
+        """
+        import ujson
+        self.ujson = ujson
+
+    def loads(self, data):
+        return self.ujson.loads(data)
+
+class OrjsonDecoder(object):
+    """
+    orjson decoder (requires orjson, Python 3)
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        """
+        Class instantiation
+        """
+        import orjson
+        self.orjson = orjson
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+decoders = dict((c.name, c) for c in
+                (SimplejsonDecoder, JsonDecoder, UjsonDecoder, OrjsonDecoder))
+
+# fastest first, used by 'auto'
+preferred_decoders = ('orjson', 'ujson', 'simplejson')
+
+def get_decoder(decoder='auto'):
+    """
+    Return decoder instance
+
+    @param decoder decoder name: 'auto' (fastest installed), 'orjson',
+        'ujson', 'simplejson', 'json' or object with a loads method
+    @return decoder instance
+    """
+    if not isinstance(decoder, basestring):
+        return decoder
+    if decoder == 'auto':
+        for name in preferred_decoders:
+            try:
+                return decoders[name]()
+            except ImportError:
+                pass
+    return decoders[decoder]()
+
+def get_ijson_backend():
+    """
+    Return the fastest ijson backend installed (requires ijson)
+
+    @return ijson backend module
+    """
+    for name in ('yajl2_c', 'yajl2_cffi', 'yajl2'):
+        try:
+            return importlib.import_module('ijson.backends.' + name)
+        except ImportError:
+            pass
+    import ijson
+    return ijson
+
+class PageStream(object):
+    """
+    List page decoded while it is read (requires ijson). The resources
+    of the list are returned in chunks and the page attributes (total,
+    next_page_uri...) are available as soon as they are parsed: only
+    the resources parsed before an attribute requested are kept in
+    memory, none when the attributes come before the list.
+    """
+    def __init__(self, response, key):
+        """
+        Class instantiation
+
+        @param response file-like object: response body
+        @param key list key: 'calls', 'sms_messages'...
+        """
+        from ijson.common import ObjectBuilder
+        self.ObjectBuilder = ObjectBuilder
+        self.response = response
+        self.key = key
+        self.item = key + '.item'
+        self.events = get_ijson_backend().parse(response)
+        # page attributes parsed so far
+        self.meta = {}
+        # resources parsed, not returned yet
+        self.pending = []
+        self.builder = None
+        self.done = False
+        # exception raised while the page was read
+        self.error = None
+
+    def parse(self):
+        """
+        Parse events until a resource or a page attribute is complete
+
+        @return False at the end of the page or if reading it failed
+        """
+        try:
+            for prefix, event, value in self.events:
+                if prefix == self.item:
+                    if event in ('start_map', 'start_array'):
+                        self.builder = self.ObjectBuilder()
+                    elif self.builder is None:
+                        # scalar item
+                        self.pending.append(value)
+                        return True
+                    self.builder.event(event, value)
+                    if event in ('end_map', 'end_array'):
+                        self.pending.append(self.builder.value)
+                        self.builder = None
+                        return True
+                elif self.builder is not None:
+                    self.builder.event(event, value)
+                elif prefix and not '.' in prefix and event in ('string', 'number', 'boolean', 'null'):
+                    self.meta[prefix] = value
+                    return True
+        except Exception, e:
+            # connection or JSON error: the page ends here
+            self.error = e
+        self.done = True
+        return False
+
+    def __getitem__(self, name):
+        """
+        Return page attribute, parse the page until it shows up
+        """
+        while not name in self.meta and not self.done:
+            self.parse()
+        return self.meta[name]
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def chunks(self, size):
+        """
+        Yield lists of up to size resources, in the page order
+
+        @param size number of resources per chunk
+        """
+        while True:
+            while len(self.pending) < size and self.parse():
+                pass
+            if not self.pending:
+                break
+            chunk, self.pending = self.pending[:size], self.pending[size:]
+            yield chunk
+
+    def close(self):
+        """
+        Close the response: the connection is reused if the page was
+        read entirely
+        """
+        self.response.close()
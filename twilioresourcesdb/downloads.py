@@ -0,0 +1,170 @@
+import os
+import time
+import traceback
+from threading import Thread, Lock
+import Queue
+
+from client import HTTPError
+
+class RecordingDownloader(object):
+    """
+    Download recordings audio files using a pool of threads. Files are
+    streamed in chunks to a .part file renamed when complete. Partial
+    files are resumed using HTTP Range requests. 429/5xx responses and
+    connection errors are retried following the client retry policy, the
+    downloads still failing are queued again by retry().
+    """
+    def __init__(self, client, url, path, concurrency=2, chunk_size=65536, debug=None):
+        """
+        Class instantiation
+
+        @param client HTTPClient
+        @param url function returning the recording URL: url(sid)
+        @param path directory to store the audio files
+        @param concurrency number of downloads in parallel
+        @param chunk_size number of bytes read and written at once
+        @param debug debug handler: debug(s, level)
+        """
+        self.client = client
+        self.url = url
+        self.path = path
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.debug = debug or (lambda s, level: None)
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.lock = Lock()
+        # SIDs of the downloads failed, queued again by retry()
+        self.failures = set()
+        self.files = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        # time spent downloading
+        self.seconds = 0.0
+
+    def add(self, sid):
+        """
+        Queue recording download, start threads if needed
+
+        @param sid recording SID
+        """
+        if not self.threads:
+            for i in range(self.concurrency):
+                t = Thread(target=self.worker)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+        self.queue.put(sid)
+
+    def retry(self):
+        """
+        Queue the failed downloads again
+        """
+        with self.lock:
+            sids, self.failures = self.failures, set()
+        for sid in sids:
+            self.add(sid)
+
+    def missing(self, sid):
+        """
+        Is the recording audio file missing or partial?
+
+        @param sid recording SID
+        @return True/False
+        """
+        return not os.path.exists(os.path.join(self.path, sid))
+
+    def join(self):
+        """
+        Wait for queued downloads to complete
+        """
+        self.queue.join()
+        self.debug('recordings: %s' % self.stats(), 1)
+
+    def worker(self):
+        """
+        Download thread
+        """
+        while True:
+            sid = self.queue.get()
+            try:
+                self.download(sid)
+            except Exception, e:
+                with self.lock:
+                    self.failed += 1
+                    if getattr(e, 'status', None) != 404:
+                        # recordings deleted are not retried
+                        self.failures.add(sid)
+                self.debug('recording %s download error: %s' % (sid, traceback.format_exc()), 1)
+            finally:
+                self.queue.task_done()
+
+    def download(self, sid):
+        """
+        Download recording audio file
+
+        @param sid recording SID
+        """
+        filename = os.path.join(self.path, sid)
+        if os.path.exists(filename):
+            with self.lock:
+                self.skipped += 1
+            return
+        part = filename + '.part'
+        offset = 0
+        headers = {'Accept-Encoding': 'identity'}
+        if os.path.exists(part):
+            offset = os.path.getsize(part)
+            headers['Range'] = 'bytes=%d-' % offset
+        start = time.time()
+        size = 0
+        try:
+            response = self.client.stream(self.url(sid), headers=headers)
+        except HTTPError, e:
+            if e.status != 416 or not offset:
+                raise
+            # nothing left to download
+            response = None
+        if response:
+            try:
+                if not response.status in (200, 206):
+                    # redirect or other response: not the audio file
+                    raise HTTPError(response.status, response.response.reason,
+                                    response.read(), dict(response.response.getheaders()))
+                if response.status != 206:
+                    # range ignored: download whole file
+                    offset = 0
+                length = response.response.getheader('content-length')
+                f = open(part, 'ab' if offset else 'wb')
+                try:
+                    while True:
+                        chunk = response.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        size += len(chunk)
+                finally:
+                    f.close()
+                if length is not None and size != int(length):
+                    # connection closed early: resumed next time
+                    raise IOError('recording %s: %d bytes received / %s' % (sid, size, length))
+            finally:
+                response.close()
+        os.rename(part, filename)
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            self.seconds += time.time() - start
+        self.debug('recording %s: %d bytes%s' % (sid, size, ' (resumed at %d)' % offset if offset else ''), 2)
+
+    def stats(self):
+        """
+        Download statistics
+
+        @return dict: files, skipped, failed, queued, bytes, bytes_per_sec
+        """
+        with self.lock:
+            return dict(files=self.files, skipped=self.skipped, failed=self.failed,
+                        queued=self.queue.qsize(), bytes=self.bytes,
+                        bytes_per_sec=self.bytes / self.seconds if self.seconds else 0.0)
@@ -1,5 +1,6 @@
 import resources
 import time
+import logging
 
 def example1(settings):
     # instantiate resources object
@@ -25,6 +26,8 @@ def example2(settings):
 
 
 if __name__ == '__main__':
+    # show debug messages
+    logging.basicConfig(level=logging.INFO)
     # settings
     settings = {}
     # Twilio account
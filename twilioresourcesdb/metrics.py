@@ -0,0 +1,175 @@
+import time
+from threading import Thread, Lock
+import BaseHTTPServer
+
+class Timer(object):
+    """
+    Context manager adding the time spent in a block to a timer
+    """
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.time() - self.start, **self.labels)
+        return False
+
+class Metrics(object):
+    """
+    Thread safe counters, gauges and timers with labels. Timers keep the
+    number of observations and their sum, exported as Prometheus
+    summaries.
+    """
+    def __init__(self, prefix='twilioresourcesdb'):
+        """
+        Class instantiation
+
+        @param prefix metrics names prefix in the Prometheus export
+        """
+        self.prefix = prefix
+        self.lock = Lock()
+        # (name, labels) -> value, labels: sorted tuple of (label, value)
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> [count, sum]
+        self.timers = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment counter
+
+        @param name counter name
+        @param value increment
+        @param labels counter labels: type='call'...
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Set gauge value
+
+        @param name gauge name
+        @param value gauge value
+        @param labels gauge labels
+        """
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Add observation to a timer
+
+        @param name timer name
+        @param seconds duration
+        @param labels timer labels
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            t = self.timers.get(key)
+            if t is None:
+                t = self.timers[key] = [0, 0.0]
+            t[0] += 1
+            t[1] += seconds
+
+    def timer(self, name, **labels):
+        """
+        Return context manager timing a block: with metrics.timer('commit'):
+
+        @param name timer name
+        @param labels timer labels
+        @return Timer
+        """
+        return Timer(self, name, labels)
+
+    def snapshot(self):
+        """
+        Metrics snapshot
+
+        @return dict: counters, gauges, timers -> name -> labels ('type=call') -> value,
+            timers values are dict: count, sum
+        """
+        def labels_str(labels):
+            return ','.join('%s=%s' % l for l in labels)
+        d = dict(counters={}, gauges={}, timers={})
+        with self.lock:
+            for kind in ('counters', 'gauges'):
+                for (name, labels), value in getattr(self, kind).items():
+                    d[kind].setdefault(name, {})[labels_str(labels)] = value
+            for (name, labels), (count, sum) in self.timers.items():
+                d['timers'].setdefault(name, {})[labels_str(labels)] = dict(count=count, sum=sum)
+        return d
+
+    def prometheus(self):
+        """
+        Metrics in the Prometheus text format
+
+        @return text
+        """
+        def labels_str(labels):
+            if not labels:
+                return ''
+            return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                     for k, v in labels)
+        lines = []
+        with self.lock:
+            for kind, type in (('counters', 'counter'), ('gauges', 'gauge')):
+                metrics = getattr(self, kind)
+                for name in sorted(set(n for n, l in metrics)):
+                    lines.append('# TYPE %s_%s %s' % (self.prefix, name, type))
+                    for (n, labels), value in sorted(metrics.items()):
+                        if n == name:
+                            lines.append('%s_%s%s %s' % (self.prefix, name, labels_str(labels), value))
+            for name in sorted(set(n for n, l in self.timers)):
+                lines.append('# TYPE %s_%s summary' % (self.prefix, name))
+                for (n, labels), (count, sum) in sorted(self.timers.items()):
+                    if n == name:
+                        lines.append('%s_%s_count%s %d' % (self.prefix, name, labels_str(labels), count))
+                        lines.append('%s_%s_sum%s %f' % (self.prefix, name, labels_str(labels), sum))
+        return '\n'.join(lines) + '\n'
+
+class MetricsServer(object):
+    """
+    HTTP server exporting metrics in the Prometheus text format:
+    GET /metrics
+    """
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        """
+        Class instantiation: start server thread
+
+        @param metrics Metrics or object with a prometheus() method
+        @param port port number
+        @param host address listened on (default: local only)
+        """
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """
+        Stop server
+        """
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,169 @@
+"""
+Versioned schema migrations. Migrations are applied in order and each one
+is recorded in the schema_migrations table. They check the DB before
+changing it so they work on tables created by any previous version and
+on tables just created from the current specs.
+
+Indexes and columns are added online when the DB supports it:
+PostgreSQL: CREATE INDEX CONCURRENTLY
+MySQL: ALGORITHM=INPLACE, LOCK=NONE
+"""
+from datetime import datetime
+
+def quote(engine, name):
+    """
+    Quote identifier: 'to' is a reserved word
+
+    @param engine SQLAlchemy engine
+    @param name identifier
+    @return quoted identifier
+    """
+    return engine.dialect.identifier_preparer.quote(name)
+
+def has_index(engine, table, columns, unique=False):
+    """
+    Is there an index or a unique constraint on these columns?
+
+    @param engine SQLAlchemy engine
+    @param table table name
+    @param columns columns names
+    @param unique True to only consider unique indexes
+    @return True/False
+    """
+    from sqlalchemy import inspect
+    inspector = inspect(engine)
+    columns = list(columns)
+    for ix in inspector.get_indexes(table):
+        if ix['column_names'] == columns and (ix['unique'] or not unique):
+            return True
+    for uc in inspector.get_unique_constraints(table):
+        if uc['column_names'] == columns:
+            return True
+    return False
+
+def create_index(engine, table, name, columns, unique=False):
+    """
+    Create index without blocking writes on the table
+
+    @param engine SQLAlchemy engine
+    @param table table name
+    @param name index name
+    @param columns columns names
+    @param unique True for a unique index
+    """
+    sql = 'CREATE %sINDEX %%s%s ON %s (%s)' % ('UNIQUE ' if unique else '',
+        quote(engine, name), quote(engine, table), ', '.join(quote(engine, c) for c in columns))
+    if engine.dialect.name == 'postgresql':
+        # CONCURRENTLY cannot run in a transaction
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(sql % 'CONCURRENTLY ')
+    elif engine.dialect.name == 'mysql':
+        engine.execute(sql % '' + ' ALGORITHM=INPLACE LOCK=NONE')
+    else:
+        engine.execute(sql % '')
+
+def add_column(engine, table, column):
+    """
+    Add nullable column without rewriting the table when possible
+
+    @param engine SQLAlchemy engine
+    @param table table name
+    @param column SQLAlchemy column
+    """
+    sql = 'ALTER TABLE %s ADD COLUMN %s %s' % (quote(engine, table),
+        quote(engine, column.name), column.type.compile(dialect=engine.dialect))
+    if engine.dialect.name == 'mysql':
+        sql += ', ALGORITHM=INPLACE, LOCK=NONE'
+    engine.execute(sql)
+
+def add_columns(engine, schema, debug):
+    """
+    Add resources columns missing in tables created by previous versions:
+    notifications requestUrl, responseHeaders, responseBody, resources
+    content hash
+    """
+    from sqlalchemy import inspect
+    inspector = inspect(engine)
+    for table in schema['tables'].values():
+        existing = set(c['name'] for c in inspector.get_columns(table.name))
+        for column in table.columns:
+            if not column.name in existing:
+                debug('add column %s.%s' % (table.name, column.name), 1)
+                add_column(engine, table.name, column)
+
+def unique_accounts_sid(engine, schema, debug):
+    """
+    Add unique index on accounts sid. Not applied if the table has
+    duplicated accounts, they need to be removed first.
+    """
+    from sqlalchemy import select, func
+    table = schema['tables']['account']
+    if has_index(engine, table.name, ['sid'], unique=True):
+        return
+    duplicates = engine.execute(select([table.c.sid]).group_by(table.c.sid)
+                                .having(func.count() > 1)).fetchall()
+    if duplicates:
+        debug('duplicated accounts %s: unique index on accounts.sid not created' %
+              ', '.join(r[0] for r in duplicates), 1)
+        return False
+    debug('create unique index on accounts.sid', 1)
+    create_index(engine, table.name, 'uq_accounts_sid', ['sid'], unique=True)
+
+def create_indexes(engine, schema, debug):
+    """
+    Create resources indexes missing in tables created by previous
+    versions
+    """
+    for table in schema['tables'].values():
+        for index in table.indexes:
+            columns = [c.name for c in index.columns]
+            if not has_index(engine, table.name, columns):
+                debug('create index %s' % index.name, 1)
+                create_index(engine, table.name, index.name, columns, index.unique)
+
+def add_checkpoints_columns(engine, schema, debug):
+    """
+    Add checkpoints columns missing in tables created by previous
+    versions: resumeDateCreated
+    """
+    from sqlalchemy import inspect
+    table = schema['checkpoints']
+    existing = set(c['name'] for c in inspect(engine).get_columns(table.name))
+    for column in table.columns:
+        if not column.name in existing:
+            debug('add column %s.%s' % (table.name, column.name), 1)
+            add_column(engine, table.name, column)
+
+# (version, description, migration function)
+# a function returning False is not recorded and is tried again on next startup
+migrations = (
+    (1, 'add missing resources columns', add_columns),
+    (2, 'unique accounts sid', unique_accounts_sid),
+    (3, 'resources indexes', create_indexes),
+    (4, 'resources content hash', add_columns),
+    (5, 'checkpoints resume date', add_checkpoints_columns),
+)
+
+def migrate(engine, schema, debug):
+    """
+    Apply migrations not applied yet
+
+    @param engine SQLAlchemy engine
+    @param schema schema dict: tables, schema_migrations table
+    @param debug debug handler: debug(s, level)
+    @return True if all migrations are applied
+    """
+    from sqlalchemy import select
+    table = schema['schema_migrations']
+    applied = set(r[0] for r in engine.execute(select([table.c.version])))
+    complete = True
+    for version, description, migration in migrations:
+        if version in applied:
+            continue
+        debug('migration %d: %s' % (version, description), 1)
+        if migration(engine, schema, debug) is False:
+            complete = False
+            continue
+        engine.execute(table.insert(), version=version, description=description,
+                       applied=datetime.utcnow())
+    return complete
@@ -0,0 +1,74 @@
+from threading import Thread, Condition
+
+class PagePrefetcher(object):
+    """
+    Fetch pages of a resources list ahead of the writer, keeping up to
+    window requests in flight. Pages are returned in order.
+    """
+    def __init__(self, fetch, first_page, num_pages, window):
+        """
+        Class instantiation: start fetching pages
+
+        @param fetch function returning a page JSON or None: fetch(page)
+        @param first_page first page to fetch
+        @param num_pages number of pages of the list
+        @param window maximum number of pages fetched ahead
+        """
+        self.fetch = fetch
+        self.num_pages = num_pages
+        self.window = window
+        self.next_page = first_page
+        # next page the writer will ask for
+        self.current_page = first_page
+        self.pages = {}
+        self.closed = False
+        self.cond = Condition()
+        for i in range(min(window, num_pages - first_page)):
+            t = Thread(target=self.worker)
+            t.daemon = True
+            t.start()
+
+    def worker(self):
+        """
+        Fetch pages until the last page is reached or the prefetcher
+        is closed
+        """
+        while True:
+            with self.cond:
+                while (not self.closed and self.next_page < self.num_pages and
+                        self.next_page >= self.current_page + self.window):
+                    self.cond.wait()
+                if self.closed or self.next_page >= self.num_pages:
+                    return
+                page = self.next_page
+                self.next_page += 1
+            data = self.fetch(page)
+            with self.cond:
+                self.pages[page] = data
+                self.cond.notify_all()
+
+    def get(self, page):
+        """
+        Return page, wait for it if it is still being fetched
+
+        @param page page number
+        @return page JSON or None if the request failed
+        """
+        if page >= self.num_pages:
+            return self.fetch(page)
+        with self.cond:
+            while not page in self.pages:
+                self.cond.wait()
+            data = self.pages.pop(page)
+            self.current_page = page + 1
+            self.cond.notify_all()
+        return data
+
+    def close(self):
+        """
+        Stop fetching pages
+        """
+        with self.cond:
+            self.closed = True
+            self.pages.clear()
+            self.cond.notify_all()
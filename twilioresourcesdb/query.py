@@ -0,0 +1,161 @@
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+
+from cache import LRUCache
+from specs import specs
+from dates import sortable_date_format as date_format
+from resources import TException
+
+class ResourceQuery(object):
+    """
+    Read resources from the DB: filter by account, date range, status and
+    number, newest first. Results are paged with keyset cursors and cached
+    for a few seconds. The cache of a resource type is invalidated when
+    the Resources object writes new resources of that type.
+    """
+    def __init__(self, resources, cache_ttl=60, cache_size=1000, batch_size=100):
+        """
+        Class instantiation
+
+        @param resources Resources object: DB connection
+        @param cache_ttl number of seconds a result is cached, 0 to disable
+        @param cache_size maximum number of results cached
+        @param batch_size number of Redis index entries read at once
+        """
+        self.resources = resources
+        self.cache_ttl = cache_ttl
+        self.cache = LRUCache(cache_size if cache_ttl else 0)
+        self.batch_size = batch_size
+        # resource type -> generation, incremented to invalidate the cache
+        self.generations = {}
+        self.lock = Lock()
+        resources.queries.append(self)
+
+    def find(self, resource_type, account_sid=None, since=None, until=None,
+             status=None, number=None, limit=50, cursor=None):
+        """
+        Find resources, newest first
+
+        @param resource_type type of resource: call, sms_message, recording...
+        @param account_sid account SID (default: Resources account)
+        @param since datetime (UTC), resources created at or after, or
+            timedelta before now: timedelta(hours=24) for the last 24h
+        @param until datetime (UTC), resources created before
+        @param status status or list of statuses
+        @param number phone number: to or from
+        @param limit maximum number of resources returned
+        @param cursor cursor returned by the previous call: next page
+        @return (records, cursor) cursor is None on the last page
+        """
+        if not resource_type in specs or not 'accountSid' in specs[resource_type].columns:
+            raise TException('resource type not supported: %s' % resource_type)
+        if number and not 'to' in specs[resource_type].columns:
+            raise TException('%s has no number' % resource_type)
+        if status and not 'status' in specs[resource_type].columns:
+            raise TException('%s has no status' % resource_type)
+        if account_sid is None:
+            account_sid = self.resources.account_sid
+        if isinstance(status, basestring):
+            status = (status,)
+        key = (resource_type, self.generations.get(resource_type, 0), account_sid,
+               since, until, status and tuple(status), number, limit, cursor)
+        if self.cache_ttl:
+            cached = self.cache.get(key)
+            if cached and cached[0] > time.time():
+                return cached[1]
+        if isinstance(since, timedelta):
+            since = datetime.utcnow() - since
+        if self.resources.sql:
+            result = self.find_sql(resource_type, account_sid, since, until,
+                                   status, number, limit, cursor)
+        else:
+            result = self.find_redis(resource_type, account_sid, since, until,
+                                     status, number, limit, cursor)
+        if self.cache_ttl:
+            self.cache.put(key, (time.time() + self.cache_ttl, result))
+        return result
+
+    def find_sql(self, resource_type, account_sid, since, until, status, number, limit, cursor):
+        """
+        Find resources in a SQL DB: keyset pagination on (dateCreated, id)
+
+        @return (records, cursor)
+        """
+        from sqlalchemy import select, and_, or_
+        spec = specs[resource_type]
+        table = self.resources.tables[resource_type]
+        c = table.c
+        where = [c.accountSid == account_sid]
+        if since:
+            where.append(c.dateCreated >= since)
+        if until:
+            where.append(c.dateCreated < until)
+        if status:
+            where.append(c.status.in_(status))
+        if number:
+            where.append(or_(c.to == number, c.cfrom == number))
+        if cursor:
+            date, id = cursor.rsplit(' ', 1)
+            date, id = datetime.strptime(date, date_format), int(id)
+            where.append(or_(c.dateCreated < date, and_(c.dateCreated == date, c.id < id)))
+        columns = [c.id] + [c[name] for name in spec.columns]
+        stmt = (select(columns).where(and_(*where))
+                .order_by(c.dateCreated.desc(), c.id.desc()).limit(limit + 1))
+        rows = self.resources.engine.execute(stmt).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = '%s %d' % (last['dateCreated'].strftime(date_format), last['id'])
+        return [spec.record_class(*row[1:]) for row in rows], next_cursor
+
+    def find_redis(self, resource_type, account_sid, since, until, status, number, limit, cursor):
+        """
+        Find resources in Redis: keyset pagination on the resources index
+        sorted set, members are '<date created> <sid>' and are read in
+        reverse lexicographical order. Status and number are filtered
+        on the resources.
+
+        @return (records, cursor)
+        """
+        spec = specs[resource_type]
+        r = self.resources.redis
+        key = self.resources.get_index_key(account_sid, resource_type)
+        if cursor:
+            max = '(' + cursor
+        elif until:
+            max = '(' + until.strftime(date_format)
+        else:
+            max = '+'
+        min = '[' + since.strftime(date_format) if since else '-'
+        records = []
+        while True:
+            members = r.zrevrangebylex(key, max, min, start=0, num=self.batch_size)
+            if not members:
+                return records, None
+            values = r.mget([m.rsplit(' ', 1)[1] for m in members])
+            for member, value in zip(members, values):
+                if value is None:
+                    # deleted
+                    continue
+                resource = self.resources.serializer.loads(value)
+                if status and not resource.get('status') in status:
+                    continue
+                if number and not number in (resource.get('to'), resource.get('from')):
+                    continue
+                records.append(spec.record(resource))
+                if len(records) == limit:
+                    return records, member
+            if len(members) < self.batch_size:
+                return records, None
+            max = '(' + members[-1]
+
+    def invalidate(self, resource_type):
+        """
+        Invalidate cached results of a resource type
+
+        @param resource_type type of resource: call, sms...
+        """
+        with self.lock:
+            self.generations[resource_type] = self.generations.get(resource_type, 0) + 1
@@ -0,0 +1,87 @@
+import random
+import time
+from threading import Lock
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket rate limiter
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Class instantiation
+
+        @param rate number of tokens added per second
+        @param burst maximum number of tokens (default: rate)
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = Lock()
+
+    def acquire(self):
+        """
+        Take one token, wait until one is available
+
+        @return number of seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter, honours Retry-After up to the
+    maximum delay
+    """
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=30,
+                 statuses=(429, 500, 502, 503, 504)):
+        """
+        Class instantiation
+
+        @param max_attempts maximum number of attempts of a request
+        @param base_delay delay in seconds before the first retry
+        @param max_delay maximum delay in seconds between two attempts
+        @param statuses HTTP statuses retried
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.statuses = statuses
+
+    def retry(self, attempt, status=None):
+        """
+        Should a failed attempt be retried?
+
+        @param attempt attempt number, starting at 1
+        @param status HTTP status, None for a connection error
+        @return True/False
+        """
+        if attempt >= self.max_attempts:
+            return False
+        return status is None or status in self.statuses
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Return delay before next attempt
+
+        @param attempt attempt number, starting at 1
+        @param retry_after Retry-After header value
+        @return delay in seconds, max_delay at most
+        """
+        if retry_after:
+            try:
+                return min(self.max_delay, max(0, float(retry_after)))
+            except ValueError:
+                # HTTP date: use backoff
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
@@ -1,295 +1,185 @@
 import sys, os
-from email.utils import parsedate
-from threading import Thread
+from email.utils import parsedate_tz, mktime_tz
+import urllib
+from threading import Thread, Event, Lock
+import hashlib
+import traceback
+import Queue
 import logging
 import time
+from datetime import datetime, timedelta
 
 import simplejson
-import twilio
 
-try:
-    from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, ForeignKey, create_engine, Text, Boolean
-    from sqlalchemy.ext.declarative import declarative_base
-    from sqlalchemy.orm import sessionmaker, mapper, relationship, backref
-except:
-    pass
-
-try:
-    import redis
-except:
-    pass
-
-class Call(object):
+from cache import LRUCache
+from client import HTTPClient
+from ratelimit import TokenBucket, RetryPolicy
+from serializers import get_serializer
+from decoders import get_decoder, PageStream
+from active import ActiveSet, SqlActiveSpill, RedisActiveSpill
+from prefetch import PagePrefetcher
+from downloads import RecordingDownloader
+from scheduler import Scheduler
+from metrics import Metrics, MetricsServer
+from specs import specs, resource_specs, parent_types, hash_column
+from migrations import migrate, migrations
+from dates import convert_rfc822_to_datetime, convert_rfc822_to_mysql_datetime, date_cache, sortable_date_format
+
+logger = logging.getLogger('twilioresourcesdb')
+logger.addHandler(logging.NullHandler())
+
+# SQLAlchemy and redis are imported when the connection is setup so only 
+# the backend used is loaded
+
+# types of resources which can be active: queued, in-progress...
+active_types = ('call', 'transcription', 'conference', 'sms_message')
+
+# list filters used to settle active resources in batch:
+# (date filter, end statuses requested, None for no status filter)
+active_filters = {
+    'call': ('StartTime>', ('completed', 'busy', 'no-answer', 'failed', 'canceled')),
+    'conference': ('DateCreated>', ('completed',)),
+    'sms_message': ('DateSent>', (None,)),
+}
+
+# resource type -> list filter on the date of the resources, used by the
+# watermark sync mode
+watermark_filters = {
+    'call': 'StartTime>',
+    'sms_message': 'DateSent>',
+    'recording': 'DateCreated>',
+    'conference': 'DateCreated>',
+    'notification': 'MessageDate>',
+}
+
+# classes mapped to the resources tables, generated from the resources specs
+Account = specs['account'].make_class()
+Call = specs['call'].make_class()
+SmsMessage = specs['sms_message'].make_class()
+Recording = specs['recording'].make_class()
+Transcription = specs['transcription'].make_class()
+Notification = specs['notification'].make_class()
+Conference = specs['conference'].make_class()
+Participant = specs['participant'].make_class()
+OutgoingCallerId = specs['outgoing_caller_id'].make_class()
+IncomingPhoneNumber = specs['incoming_phone_number'].make_class()
+
+class Checkpoint(object):
     """
-    Call resource
+    Sync checkpoint of a resource type for an account
     """
-    def __init__(self, resource):
+    def __init__(self, account_sid, resource_type):
         """
         Class instantiation
 
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.parentCallSid = resource['parent_call_sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(
-            resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(
-            resource['date_updated'])
-        self.accountSid = resource['account_sid']
-        self.to = resource['to']
-        self.cfrom = resource['from']
-        self.phoneNumberSid = resource['phone_number_sid']
-        self.status = resource['status']
-        self.startTime = convert_rfc822_to_mysql_datetime(resource['start_time'])
-        self.endTime = convert_rfc822_to_mysql_datetime(resource['end_time'])
-        self.duration = resource['duration']
-        self.price = resource['price']
-        self.direction = resource['direction']
-        self.answeredBy = resource['answered_by']
-        self.forwardedFrom = resource['forwarded_from']
-        self.callerName = resource['caller_name']
-        self.uri = resource['uri']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<call('%s')>" % (self.sid)
-
-class Recording(object):
-    """
-    Recording resource
-    """
-    def __init__(self, resource):
+        @param account_sid account SID
+        @param resource_type type of resource: call, sms message...
         """
-        Class instantiation
+        self.accountSid = account_sid
+        self.resourceType = resource_type
+        self.items = 0
+        self.lastSid = None
+        self.lastDateCreated = None
+        self.resumeDateCreated = None
+        self.active = None
 
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.accountSid = resource['account_sid']
-        self.callSid = resource['call_sid']
-        self.duration = resource['duration']
-        self.apiVersion = resource['api_version']
-        self.uri = resource['uri']
-        self.callId = resource['call_id']
-        self.accountId = resource['account_id']
-        
     def __repr__(self):
-        return "<recording('%s')>" % (self.sid)
+        return "<checkpoint('%s', '%s')>" % (self.accountSid, self.resourceType)
 
-class Transcription(object):
-    """
-    Transcription resource
-    """
-    def __init__(self, resource):
-        """
-        Class instantiation
+resource_classes = dict(account=Account, call=Call, sms_message=SmsMessage,
+    recording=Recording, transcription=Transcription, notification=Notification,
+    conference=Conference, participant=Participant,
+    outgoing_caller_id=OutgoingCallerId, incoming_phone_number=IncomingPhoneNumber)
 
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.accountSid = resource['account_sid']
-        self.status = resource['status']
-        self.recordingSid = resource['recording_sid']
-        self.duration = resource['duration']
-        self.transcriptionText = resource['transcription_text']
-        self.price = resource['price']
-        self.uri = resource['uri']
-        self.recordingId = resource['recording_id']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<transcription('%s')>" % (self.sid)
+# tables and mappings, built once per process
+schema = {}
+schema_lock = Lock()
 
-class Notification(object):
-    """
-    Notification resource
-    """
-    def __init__(self, resource):
-        """
-        Class instantiation
+# DB settings -> engine or Redis client, shared in a process
+connections = {}
+connections_lock = Lock()
 
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.accountSid = resource['account_sid']
-        self.callSid = resource['call_sid']
-        self.apiVersion = resource['api_version']
-        self.log = resource['log']
-        self.errorCode = resource['error_code']
-        self.moreInfo = resource['more_info']
-        self.messageText = resource['message_text']
-        self.messageDate = convert_rfc822_to_mysql_datetime(resource['message_date'])
-        self.requestUrl = resource['request_url']
-        self.requestMethod = resource['request_method']
-        self.requestVariables = resource['request_variables']
-        self.responseHeaders = resource['response_headers']
-        self.responseBody = resource['response_body']
-        self.uri = resource['uri']
-        self.callId = resource['call_id']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<notification('%s')>" % (self.sid)
-
-class Conference(object):
-    """
-    Conference resource
+def build_schema():
     """
-    def __init__(self, resource):
-        """
-        Class instantiation
+    Build tables from the resources specs and map them to the resources
+    classes. Done once per process.
 
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.friendlyName = resource['friendly_name']
-        self.status = resource['status']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.accountSid = resource['account_sid']
-        self.uri = resource['uri']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<conference('%s')>" % (self.sid)
-
-class Participant(object):
-    """
-    Participant resource
-    """
-    def __init__(self, resource):
-        """
-        Class instantiation
-
-        @param resource resource JSON attribute
-        """
-        self.callSid = resource['call_sid']
-        self.conferenceSid = resource['conference_sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.accountSid = resource['account_sid']
-        self.muted = resource['muted']
-        self.startConferenceOnEnter = resource['start_conference_on_enter']
-        self.endConferenceOnExit = resource['start_conference_on_exit']
-        self.uri = resource['uri']
-        self.callId = resource['call_id']
-        self.conferenceId = resource['conference_id']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<participant('%s')>" % (self.sid)
-
-class Account(object):
-    """
-    Account resource
-    """
-    def __init__(self, resource):
-        """
-        Class instantiation
-
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.friendlyName = resource['friendly_name']
-        self.status = resource['status']
-        self.authToken = resource['auth_token']
-        self.uri = resource['uri']
-        
-    def __repr__(self):
-        return "<account('%s')>" % (self.sid)
-
-class SmsMessage(object):
+    @return dict: metadata, tables (by resource type), checkpoints, 
+        active, schema_info tables and version (hash of the tables
+        definitions)
     """
-    Sms message resource
-    """
-    def __init__(self, resource):
-        """
-        Class instantiation
-
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.dateSent = convert_rfc822_to_mysql_datetime(resource['date_sent'])
-        self.accountSid = resource['account_sid']
-        self.cfrom = resource['from']
-        self.to = resource['to']
-        self.body = resource['body']
-        self.status = resource['status']
-        self.direction = resource['direction']
-        self.price = resource['price']
-        self.apiVersion = resource['api_version']
-        self.uri = resource['uri']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<sms_message('%s')>" % (self.sid)
-
-class OutgoingCallerId(object):
-    """
-    Outgoing caller ID
-    """
-    def __init__(self, resource):
-        """
-        Class instantiation
+    with schema_lock:
+        if schema:
+            return schema
+        from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, Text, UniqueConstraint, Float, Index
+        from sqlalchemy.orm import mapper
+        metadata = MetaData()
+
+        # resources tables
+        tables = {}
+        for spec in resource_specs:
+            tables[spec.type] = spec.make_table(metadata)
+
+        # Sync checkpoints table
+        checkpoints_table = Table('checkpoints', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('accountSid', String(34)),
+            Column('resourceType', String(32)),
+            Column('items', Integer),
+            Column('lastSid', String(34)),
+            Column('lastDateCreated', String(32)),
+            Column('resumeDateCreated', String(32)),
+            Column('active', Text),
+            UniqueConstraint('accountSid', 'resourceType')
+        )
 
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.friendlyName = resource['friendly_name']
-        self.accountSid = resource['account_sid']
-        self.phoneNumber = resource['phone_number']
-        self.uri = resource['uri']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<outgoing_caller_id('%s')>" % (self.sid)
+        # Active resources spilled over from memory
+        active_table = Table('active_resources', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('accountSid', String(34)),
+            Column('resourceType', String(32)),
+            Column('sid', String(34), unique=True),
+            Column('firstSeen', Float),
+            Column('created', Float),
+            Column('status', String(16)),
+            Column('nextPoll', Float),
+            Index('ix_active_resources_accountSid_resourceType_nextPoll',
+                  'accountSid', 'resourceType', 'nextPoll')
+        )
 
-class IncomingPhoneNumber(object):
-    """
-    Call resource
-    """
-    def __init__(self, resource):
-        """
-        Class instantiation
+        # Schema version marker
+        schema_info_table = Table('schema_info', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('version', String(40))
+        )
 
-        @param resource resource JSON attribute
-        """
-        self.sid = resource['sid']
-        self.dateCreated = convert_rfc822_to_mysql_datetime(resource['date_created'])
-        self.dateUpdated = convert_rfc822_to_mysql_datetime(resource['date_updated'])
-        self.friendlyName = resource['friendly_name']
-        self.accountSid = resource['account_sid']
-        self.phoneNumber = resource['phone_number']
-        self.apiVersion = resource['api_version']
-        self.voiceCallerIdLookup = resource['voice_caller_id_lookup']
-        self.voiceUrl = resource['voice_url']
-        self.voiceMethod = resource['voice_method']
-        self.voiceFallbackUrl = resource['voice_fallback_url']
-        self.voiceFallbackMethod = resource['voice_fallback_method']
-        self.statusCallback = resource['status_callback']
-        self.statusCallbackMethod = resource['status_callback_method']
-        self.smsUrl = resource['sms_url']
-        self.smsMethod = resource['sms_method']
-        self.smsFallbackUrl = resource['sms_fallback_url']
-        self.smsFallbackMethod = resource['sms_fallback_method']
-        self.uri = resource['uri']
-        self.accountId = resource['account_id']
-        
-    def __repr__(self):
-        return "<incoming_phone_number('%s')>" % (self.sid)
+        # Migrations applied
+        schema_migrations_table = Table('schema_migrations', metadata,
+            Column('version', Integer, primary_key=True, autoincrement=False),
+            Column('description', String(128)),
+            Column('applied', DateTime)
+        )
 
+        # mapping between tables and classes
+        for spec in resource_specs:
+            mapper(resource_classes[spec.type], tables[spec.type])
+        mapper(Checkpoint, checkpoints_table)
+
+        h = hashlib.sha1('migrations %d' % len(migrations))
+        for table in metadata.sorted_tables:
+            h.update(table.name)
+            for c in table.columns:
+                h.update('%s %r %s %s %s' % (c.name, c.type, c.primary_key, c.unique, 
+                    ','.join(sorted(fk.target_fullname for fk in c.foreign_keys))))
+            for constraint in table.constraints:
+                h.update('%s %s' % (type(constraint).__name__, ','.join(sorted(constraint.columns.keys()))))
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                h.update('%s %s %s' % (index.name, index.unique, ','.join(c.name for c in index.columns)))
+        schema.update(metadata=metadata, tables=tables, checkpoints=checkpoints_table,
+                      active=active_table,
+                      schema_info=schema_info_table, schema_migrations=schema_migrations_table,
+                      version=h.hexdigest())
+        return schema
 
 class Resources(Thread):
     """
@@ -309,7 +199,61 @@ class Resources(Thread):
             raise TException("Twilio account token is required")
         self.account_sid = settings['account_sid']
         self.account_token = settings['account_token']
+        # master account SID authenticating the subaccount requests
+        if not 'auth_sid' in settings:
+            self.auth_sid = self.account_sid
+        else:
+            self.auth_sid = settings['auth_sid']
         self.api_version = '2010-04-01'
+        if not 'api_base_url' in settings:
+            self.api_base_url = 'https://api.twilio.com'
+        else:
+            self.api_base_url = settings['api_base_url']
+        if not 'workers' in settings:
+            self.workers = 1
+        else:
+            self.workers = settings['workers']
+        if not 'worker_ordering' in settings:
+            self.worker_ordering = True
+        else:
+            self.worker_ordering = settings['worker_ordering']
+        if not 'http_pool_size' in settings:
+            # one connection per worker
+            self.http_pool_size = max(4, self.workers)
+        else:
+            self.http_pool_size = settings['http_pool_size']
+        if not 'http_timeout' in settings:
+            self.http_timeout = 30
+        else:
+            self.http_timeout = settings['http_timeout']
+        if not 'rate_limit' in settings:
+            self.rate_limit = None
+        else:
+            self.rate_limit = settings['rate_limit']
+        if not 'rate_burst' in settings:
+            self.rate_burst = None
+        else:
+            self.rate_burst = settings['rate_burst']
+        if not 'max_attempts' in settings:
+            self.max_attempts = 5
+        else:
+            self.max_attempts = settings['max_attempts']
+        if not 'retry_base_delay' in settings:
+            self.retry_base_delay = 0.5
+        else:
+            self.retry_base_delay = settings['retry_base_delay']
+        if not 'retry_max_delay' in settings:
+            self.retry_max_delay = 30
+        else:
+            self.retry_max_delay = settings['retry_max_delay']
+        rate_limiter = None
+        if self.rate_limit:
+            rate_limiter = TokenBucket(self.rate_limit, self.rate_burst)
+        # shared by all API requests
+        self.client = HTTPClient(self.api_base_url, self.auth_sid,
+            self.account_token, self.http_pool_size, self.http_timeout,
+            rate_limiter, RetryPolicy(self.max_attempts, self.retry_base_delay,
+                                      self.retry_max_delay))
         if not 'database_type' in settings:
             raise TException("Database type is required")
         self.database_type = settings['database_type']
@@ -339,6 +283,18 @@ class Resources(Thread):
                 self.database_port = None
         else:
             self.database_port = settings['database_port']
+        if (self.database_type == 'sqlite' and self.database_name == ':memory:'
+                and self.workers > 1):
+            # one connection: the workers transactions would interleave
+            raise TException("An in-memory SQLite DB can not be shared by workers")
+        if not 'sqlite_synchronous' in settings:
+            self.sqlite_synchronous = 'NORMAL'
+        else:
+            self.sqlite_synchronous = settings['sqlite_synchronous']
+        if not 'sqlite_cache_size' in settings:
+            self.sqlite_cache_size = 65536
+        else:
+            self.sqlite_cache_size = settings['sqlite_cache_size']
         if not 'download_recordings' in settings:
             self.download_recordings = False
         else:
@@ -348,18 +304,159 @@ class Resources(Thread):
             self.recording_path = settings['recording_path']
             if not os.path.exists(self.recording_path):
                 os.mkdir(self.recording_path)
+            if not 'download_workers' in settings:
+                download_workers = 2
+            else:
+                download_workers = settings['download_workers']
+            if not 'download_chunk_size' in settings:
+                download_chunk_size = 65536
+            else:
+                download_chunk_size = settings['download_chunk_size']
+            self.downloader = RecordingDownloader(self.client, self.get_recording_url,
+                self.recording_path, download_workers, download_chunk_size, self.debug)
+            # recordings stored by a previous run checked for missing files
+            self.recordings_checked = False
         if not 'page_size' in settings:
             self.page_size = 50
         else:
             self.page_size = settings['page_size']
+        if not 'prefetch_pages' in settings:
+            self.prefetch_pages = 0
+        else:
+            self.prefetch_pages = settings['prefetch_pages']
+        if not 'stream_pages' in settings:
+            self.stream_pages = False
+        else:
+            self.stream_pages = settings['stream_pages']
+        if self.stream_pages:
+            try:
+                import ijson
+            except ImportError:
+                raise TException("stream_pages requires ijson")
+        if not 'stream_chunk_size' in settings:
+            self.stream_chunk_size = 100
+        else:
+            self.stream_chunk_size = settings['stream_chunk_size']
+        if not 'json_decoder' in settings:
+            json_decoder = 'auto'
+        else:
+            json_decoder = settings['json_decoder']
+        try:
+            self.decoder = get_decoder(json_decoder)
+        except (KeyError, ImportError), e:
+            raise TException("JSON decoder %s not available: %s" % (json_decoder, e))
+        if not 'page_retries' in settings:
+            self.page_retries = 2
+        else:
+            self.page_retries = settings['page_retries']
+        if not 'sync_mode' in settings:
+            self.sync_mode = 'count'
+        else:
+            self.sync_mode = settings['sync_mode']
+        if not 'watermark_margin' in settings:
+            self.watermark_margin = 3600
+        else:
+            self.watermark_margin = settings['watermark_margin']
+        if not 'metrics_port' in settings:
+            self.metrics_port = None
+        else:
+            self.metrics_port = settings['metrics_port']
+        if not 'metrics_host' in settings:
+            self.metrics_host = '127.0.0.1'
+        else:
+            self.metrics_host = settings['metrics_host']
+        if not 'update_window' in settings:
+            self.update_window = 0
+        else:
+            self.update_window = settings['update_window']
+        if not 'update_frequency' in settings:
+            self.update_frequency = 300
+        else:
+            self.update_frequency = settings['update_frequency']
+        if not 'active_refresh' in settings:
+            self.active_refresh = 'poll'
+        else:
+            self.active_refresh = settings['active_refresh']
+        if not 'active_straggler_age' in settings:
+            self.active_straggler_age = 300
+        else:
+            self.active_straggler_age = settings['active_straggler_age']
+        if not 'active_max_size' in settings:
+            self.active_max_size = 10000
+        else:
+            self.active_max_size = settings['active_max_size']
+        if not 'active_spill_interval' in settings:
+            self.active_spill_interval = 300
+        else:
+            self.active_spill_interval = settings['active_spill_interval']
+        if not 'active_max_age' in settings:
+            self.active_max_age = 86400
+        else:
+            self.active_max_age = settings['active_max_age']
         if not 'check_frequency' in settings:
             self.check_frequency = 5
         else:
             self.check_frequency = settings['check_frequency']
+        if not 'check_frequencies' in settings:
+            self.check_frequencies = {}
+        else:
+            self.check_frequencies = settings['check_frequencies']
+        if not 'max_check_interval' in settings:
+            self.max_check_interval = 300
+        else:
+            self.max_check_interval = settings['max_check_interval']
+        if not 'check_backoff' in settings:
+            self.check_backoff = 2
+        else:
+            self.check_backoff = settings['check_backoff']
+        if 'assume_schema' in settings:
+            self.assume_schema = settings['assume_schema']
+        elif 'setup_tables' in settings:
+            self.assume_schema = not settings['setup_tables']
+        else:
+            self.assume_schema = False
+        if not 'resource_types' in settings:
+            self.resource_types = None
+        else:
+            self.resource_types = settings['resource_types']
+        if not 'checkpoints' in settings:
+            self.checkpoints = True
+        else:
+            self.checkpoints = settings['checkpoints']
+        # DB round trips saved by the page-level existence checks
+        self.round_trips_saved = 0
+        if not 'sid_cache_size' in settings:
+            self.sid_cache_size = 10000
+        else:
+            self.sid_cache_size = settings['sid_cache_size']
+        if not 'bulk_insert' in settings:
+            self.bulk_insert = False
+        else:
+            self.bulk_insert = settings['bulk_insert']
+        if not 'redis_serializer' in settings:
+            redis_serializer = 'json'
+        else:
+            redis_serializer = settings['redis_serializer']
+        try:
+            self.serializer = get_serializer(redis_serializer)
+        except (KeyError, ImportError), e:
+            raise TException("Redis serializer %s not available: %s" % (redis_serializer, e))
+        # (resource type, sid) -> row id of parent resources
+        self.sid_cache = LRUCache(self.sid_cache_size)
+        # ResourceQuery objects: cache invalidated when resources are written
+        self.queries = []
+        # per stage timers and counters
+        self.metrics = Metrics()
+        self.metrics_server = None
+        if self.metrics_port:
+            self.metrics_server = MetricsServer(self, self.metrics_port, self.metrics_host)
         self.engine = None
         self.metadata = None
+        self.tables = {}
         self.session = None
         self.redis = None
+        # set to wake up the process loop as soon as we stop
+        self.stop_event = Event()
         self.stop = False
         self.dbg_level = 2
         if self.database_type == 'redis':
@@ -379,13 +476,33 @@ class Resources(Thread):
                                  ('outgoing_caller_id', OutgoingCallerId),
                                  ('incoming_phone_number', IncomingPhoneNumber) 
                                  )
+        self.resource_classes = resource_classes
         for t, c in resources:
-            lr = dict(type=t, items=0, active={}, cls=c)
+            if self.resource_types and not t in self.resource_types:
+                continue
+            # active: ActiveSet, created once connected to the DB
+            # pending: compact records added since the last commit
+            # watermark_sids: SIDs created at last_date_created
+            # refreshed: last time the update window was refreshed
+            # caught_up: the last page processed reached a resource stored
+            # resume: oldest date processed by a sync not finished yet
+            lr = dict(type=t, items=0, active=None, cls=c, last_sid=None,
+                      last_date_created=None, resume=None, pending=[],
+                      activity=0, watermark_sids=set(), refreshed=0,
+                      caught_up=False)
             self.list_resources.append(lr)
 
+        self.scheduler = Scheduler(dict((lr['type'], 
+            self.check_frequencies.get(lr['type'], self.check_frequency))
+            for lr in self.list_resources), self.max_check_interval, self.check_backoff)
+
         self.setup_connection()
         if self.sql:
             self.setup_tables()
+        for lr in self.list_resources:
+            lr['active'] = self.make_active_set(lr['type'])
+        if self.checkpoints:
+            self.load_checkpoints()
 
     def run(self):
         """
@@ -395,233 +512,228 @@ class Resources(Thread):
 
     def setup_connection(self):
         """
-        Create DB session
+        Create DB session. Engines and Redis clients are shared by the
+        Resources objects of a process using the same DB: one connection
+        pool for all the accounts synced by a process.
         """
+        key = (self.database_type, self.database_user, self.database_password,
+               self.database_host, self.database_port, self.database_name)
+        if self.database_type == 'sqlite':
+            key += (self.sqlite_synchronous, self.sqlite_cache_size)
+        with connections_lock:
+            connection = connections.get(key)
+            if connection is None:
+                connection = connections[key] = self.connect()
         if self.sql:
-            self.engine = create_engine('%s://%s:%s@%s:%d/%s' % (self.database_type, self.database_user, self.database_password, self.database_host, self.database_port, self.database_name))
-            Session = sessionmaker(bind=self.engine)
-            self.session = Session()
+            from sqlalchemy.orm import sessionmaker, scoped_session
+            self.engine = connection
+            # one session per thread
+            self.session = scoped_session(sessionmaker(bind=self.engine))
+        else:
+            self.redis = connection
+
+    def connect(self):
+        """
+        Create DB engine or Redis client
+
+        @return SQLAlchemy engine or Redis client
+        """
+        if self.database_type == 'sqlite':
+            return self.create_sqlite_engine()
+        elif self.sql:
+            from sqlalchemy import create_engine
+            return create_engine('%s://%s:%s@%s:%d/%s' % (self.database_type, self.database_user, self.database_password, self.database_host, self.database_port, self.database_name))
         else:
             args = {}
             args['host'] = self.database_host
             args['port'] = self.database_port
             args['db'] = 0
             args['password'] = self.database_password
-            self.redis = redis.Redis(**args)
+            import redis
+            return redis.Redis(**args)
     
+    def create_sqlite_engine(self):
+        """
+        Create SQLite engine: database_name is the file path or ':memory:'.
+        WAL journal so readers do not block the writer, synchronous and
+        cache size pragmas set on each connection. The in-memory DB is a
+        single connection: one worker only.
+
+        @return SQLAlchemy engine
+        """
+        from sqlalchemy import create_engine, event
+        if self.database_name == ':memory:':
+            from sqlalchemy.pool import StaticPool
+            engine = create_engine('sqlite://', poolclass=StaticPool,
+                connect_args={'check_same_thread': False})
+        else:
+            # wait for the other workers writes instead of failing
+            engine = create_engine('sqlite:///%s' % self.database_name,
+                connect_args={'timeout': 60})
+        memory = self.database_name == ':memory:'
+        synchronous = self.sqlite_synchronous
+        cache_size = self.sqlite_cache_size
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(conn, record):
+            cursor = conn.cursor()
+            if not memory:
+                cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=%s' % synchronous)
+            # negative: size in KiB
+            cursor.execute('PRAGMA cache_size=-%d' % cache_size)
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            cursor.close()
+        return engine
+
     def setup_tables(self):
         """
-        Create tables if non existing, create relations between tables and mapping between
-        tables and classes.
+        Create tables from the resources specs if non existing and mapping 
+        between tables and classes.
+
+        The schema version stored in the DB is checked first so the tables
+        are only created and migrated when the schema changed. Nothing is 
+        checked with assume_schema.
         """
-        self.metadata = MetaData()
-     
-        # Calls table
-        calls_table = Table('calls', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('parentCallSid', String(34)),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('accountSid', String(34)),
-            Column('to', String(15)),
-            Column('cfrom', String(15)),
-            Column('phoneNumberSid', String(34)),
-            Column('status', String(16)),
-            Column('startTime', DateTime),
-            Column('endTime', DateTime),
-            Column('duration', Integer),
-            Column('price', String(16)),
-            Column('direction', String(16)),
-            Column('answeredBy', String(16)),
-            Column('forwardedFrom', String(15)),
-            Column('callerName', Text),
-            Column('uri', Text),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Account, backref=backref('calls', order_by=id))
-        
-        # Recordings table
-        recordings_table = Table('recordings', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('accountSid', String(34)),
-            Column('callSid', String(34)),
-            Column('duration', Integer),
-            Column('apiVersion', String(10)),
-            Column('uri', Text),
-            Column('callId', Integer, ForeignKey('calls.id')),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Call, backref=backref('recordings', order_by=id))
-        rel = relationship(Account, backref=backref('recordings', order_by=id))
-    
-        # Transcription table
-        transcriptions_table = Table('transcriptions', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('accountSid', String(34)),
-            Column('status', String(16)),
-            Column('recordingSid', String(34)),
-            Column('duration', Integer),
-            Column('transcriptionText', Text),
-            Column('price', String(16)),
-            Column('uri', Text),
-            Column('recordingId', Integer, ForeignKey('recordings.id')),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Recording, backref=backref('transcriptions', order_by=id))
-        rel = relationship(Account, backref=backref('transcriptions', order_by=id))
+        s = build_schema()
+        self.metadata = s['metadata']
+        self.tables = s['tables']
+        if self.assume_schema:
+            return
+        if self.get_schema_version() == s['version']:
+            self.debug('schema up to date: %s' % s['version'], 2)
+            return
+        # create tables: ok to call multiple times
+        self.metadata.create_all(self.engine)
+        # upgrade tables created by previous versions
+        if migrate(self.engine, s, self.debug):
+            self.set_schema_version(s['version'])
 
-        # Notifications table
-        notifications_table = Table('notifications', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('accountSid', String(34)),
-            Column('callSid', String(34)),
-            Column('apiVersion', String(10)),
-            Column('log', Integer),
-            Column('errorCode', Integer),
-            Column('moreInfo', Text),
-            Column('messageText', Text),
-            Column('messageDate', DateTime),
-            Column('requestMethod', String(16)),
-            Column('requestVariables', Text),
-            Column('requestHeaders', Text),
-            Column('requestBody', Text),
-            Column('uri', Text),
-            Column('callId', Integer, ForeignKey('calls.id')),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Call, backref=backref('notifications', order_by=id))
-        rel = relationship(Account, backref=backref('notifications', order_by=id))
+    def get_schema_version(self):
+        """
+        Return schema version stored in the DB
 
-        # Conferences table
-        conferences_table = Table('conferences', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('friendlyName', Text),
-            Column('status', String(16)),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('accountSid', String(34)),
-            Column('uri', Text),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Account, backref=backref('conferences', order_by=id))
+        @return version or None if not set
+        """
+        from sqlalchemy import select
+        table = build_schema()['schema_info']
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(select([table.c.version]).where(table.c.id == 1)).first()
+        except Exception, e:
+            # no schema_info table
+            self.debug('schema version: %s' % e, 2)
+            return None
+        return row[0] if row else None
 
-        # Participants table
-        participants_table = Table('participants', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('callSid', String(34)),
-            Column('conferenceSid', String(34)),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('accountSid', String(34)),
-            Column('muted', Boolean),
-            Column('startConferenceOnEnter', Boolean),
-            Column('endConferenceOnExit', Boolean),
-            Column('uri', Text),
-            Column('callId', Integer, ForeignKey('calls.id')),
-            Column('conferenceId', Integer, ForeignKey('conferences.id')),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Call, backref=backref('participants', order_by=id))
-        rel = relationship(Conference, backref=backref('participants', order_by=id))
-        rel = relationship(Account, backref=backref('participants', order_by=id))
+    def set_schema_version(self, version):
+        """
+        Store schema version in the DB
 
-        # Accounts table
-        accounts_table = Table('accounts', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34)),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('friendlyName', String(34)),
-            Column('status', String(16)),
-            Column('authToken', String(34)),
-            Column('uri', Text),
-        )
-    
-        # SMS messages table
-        sms_messages_table = Table('sms_messages', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('dateSent', DateTime),
-            Column('accountSid', String(34)),
-            Column('cfrom', String(15)),
-            Column('to', String(15)),
-            Column('body', String(160)),
-            Column('status', String(16)),
-            Column('direction', String(16)),
-            Column('price', String(16)),
-            Column('apiVersion', String(10)),
-            Column('uri', Text),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Account, backref=backref('sms_messages', order_by=id))
+        @param version schema version
+        """
+        table = build_schema()['schema_info']
+        with self.engine.begin() as conn:
+            conn.execute(table.delete())
+            conn.execute(table.insert(), id=1, version=version)
 
-        # Outgoing caller IDs table
-        outgoing_caller_ids_table = Table('outgoing_caller_ids', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('friendlyName', Text),
-            Column('phoneNumber', String(15)),
-            Column('accountSid', String(34)),
-            Column('uri', Text),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Account, backref=backref('outgoing_caller_ids', order_by=id))
+    def make_active_set(self, resource_type):
+        """
+        Return the active resources set of a type, spilled over to the DB
+        beyond active_max_size resources. Without checkpoints, the
+        resources spilled by a previous run are dropped.
 
-        # Incoming phone numbers table
-        incoming_phone_numbers_table = Table('incoming_phone_numbers', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('sid', String(34), unique=True),
-            Column('dateCreated', DateTime),
-            Column('dateUpdated', DateTime),
-            Column('friendlyName', Text),
-            Column('accountSid', String(34)),
-            Column('phoneNumber', String(15)),
-            Column('apiVersion', String(10)),
-            Column('voiceCallerIdLookup', Boolean),
-            Column('voiceUrl', Text),
-            Column('voiceMethod', String(16)),
-            Column('voiceFallbackUrl', Text),
-            Column('voiceFallbackMethod', String(16)),
-            Column('statusCallback', Text),
-            Column('statusCallbackMethod', String(16)),
-            Column('smsUrl', Text),
-            Column('smsMethod', String(16)),
-            Column('smsFallbackUrl', Text),
-            Column('smsFallbackMethod', String(16)),
-            Column('uri', Text),
-            Column('accountId', Integer, ForeignKey('accounts.id'))
-        )
-        rel = relationship(Account, backref=backref('incoming_phone_numbers', order_by=id))
+        @param resource_type type of resource: call, sms...
+        @return ActiveSet
+        """
+        spill = None
+        if resource_type in active_types and self.active_max_size:
+            if self.sql:
+                spill = SqlActiveSpill(self.session, build_schema()['active'],
+                                       self.account_sid, resource_type)
+            else:
+                spill = RedisActiveSpill(self.redis, self.account_sid, resource_type)
+        active = ActiveSet(resource_type, self.active_max_size, self.active_max_age,
+                           spill, self.active_spill_interval)
+        if active.spilled and not self.checkpoints:
+            active.clear()
+            if self.sql:
+                self.session.commit()
+        return active
 
-        # create tables: ok to call multiple times
-        self.metadata.create_all(self.engine)
+    def load_checkpoints(self):
+        """
+        Load sync checkpoints from the DB so we only fetch the resources
+        added since the last run
+        """
+        for lr in self.list_resources:
+            if self.sql:
+                cp = self.session.query(Checkpoint).filter_by(
+                    accountSid=self.account_sid, resourceType=lr['type']).first()
+                if not cp:
+                    continue
+                d = dict(items=cp.items, last_sid=cp.lastSid,
+                         last_date_created=cp.lastDateCreated,
+                         resume=cp.resumeDateCreated,
+                         active=simplejson.loads(cp.active) if cp.active else [])
+            else:
+                v = self.redis.get(self.get_checkpoint_key(lr))
+                if not v:
+                    continue
+                d = simplejson.loads(v)
+            lr['items'] = d['items']
+            lr['last_sid'] = d['last_sid']
+            lr['last_date_created'] = d['last_date_created']
+            lr['resume'] = d.get('resume')
+            entries = []
+            for entry in d['active']:
+                if isinstance(entry, basestring):
+                    # SIDs only in the older checkpoints
+                    entries.append((entry, None, None, None))
+                else:
+                    sid, first_seen, created, status = entry
+                    entries.append((sid, status, created, first_seen))
+            lr['active'].add(entries)
+            self.debug('%s checkpoint: %d items, %d active' % (lr['type'], lr['items'], len(lr['active'])), 1)
+        if self.sql:
+            # active resources spilled over
+            self.session.commit()
 
-        # mapping between tables and classes
-        mapper(Call, calls_table)
-        mapper(Recording, recordings_table)
-        mapper(Transcription, transcriptions_table)
-        mapper(Notification, notifications_table)
-        mapper(Conference, conferences_table)
-        mapper(Participant, participants_table)
-        mapper(Account, accounts_table)
-        mapper(SmsMessage, sms_messages_table)
-        mapper(OutgoingCallerId, outgoing_caller_ids_table)
-        mapper(IncomingPhoneNumber, incoming_phone_numbers_table)
+    def save_checkpoint(self, lr):
+        """
+        Save sync checkpoint of a resource type to the DB
+
+        @param lr list resource
+        """
+        if not self.checkpoints:
+            return
+        # the resources spilled over are in the DB already
+        active = lr['active'].dump()
+        if self.sql:
+            cp = self.session.query(Checkpoint).filter_by(
+                accountSid=self.account_sid, resourceType=lr['type']).first()
+            if not cp:
+                cp = Checkpoint(self.account_sid, lr['type'])
+                self.session.add(cp)
+            cp.items = lr['items']
+            cp.lastSid = lr['last_sid']
+            cp.lastDateCreated = lr['last_date_created']
+            cp.resumeDateCreated = lr['resume']
+            cp.active = simplejson.dumps(active)
+            self.commit()
+        else:
+            d = dict(items=lr['items'], last_sid=lr['last_sid'],
+                     last_date_created=lr['last_date_created'], resume=lr['resume'],
+                     active=active)
+            self.redis.set(self.get_checkpoint_key(lr), simplejson.dumps(d))
+
+    def get_checkpoint_key(self, lr):
+        """
+        Return checkpoint key (Redis only)
+
+        @param lr list resource
+        """
+        return 'checkpoint:%s:%s' % (self.account_sid, lr['type'])
 
     def get_resource(self, resource_type, id):
         """
@@ -636,150 +748,262 @@ class Resources(Thread):
         elif resource_type == 'sms_message':
             url = '/%s/Accounts/%s/SMS/Messages/%s.json' % (self.api_version, self.account_sid, id)
         elif resource_type == 'recording':
-            if self.recording_format == 'mp3':
-                ext = '.mp3'
-            else:
-                ext = ''
-            url = '/%s/Accounts/%s/%s/%s%s' % (self.api_version, self.account_sid, self.format_url_resource_name(resource_type) + 's', id, ext)
+            url = self.get_recording_url(id)
         else:
             url = '/%s/Accounts/%s/%s/%s.json' % (self.api_version, self.account_sid, self.format_url_resource_name(resource_type) + 's', id)
         self.debug(url, 2)
-        account = twilio.Account(self.account_sid, self.account_token)
         try:
-            d = simplejson.loads(account.request(url, 'GET'))
+            data = self.request(url, resource_type, 'get')
+            if resource_type == 'recording':
+                # audio file
+                return data
+            with self.metrics.timer('json_decode_seconds', type=resource_type):
+                d = self.decoder.loads(data)
             return d
         except Exception, e:
             self.debug(e, 1)
             return None
 
-    def get_resources_list(self, resource_type, page):
+    def request(self, url, resource_type, kind):
+        """
+        Send request, measure latency and bytes received
+
+        @param url URL path
+        @param resource_type type of resource: call, sms message...
+        @param kind endpoint type: 'list' or 'get'
+        @return response body
+        """
+        with self.metrics.timer('http_request_seconds', type=resource_type, kind=kind):
+            data = self.client.request(url)
+        self.metrics.inc('http_received_bytes_total', len(data), type=resource_type, kind=kind)
+        return data
+
+    def get_recording_url(self, id):
+        """
+        Return recording audio file URL
+
+        @param id recording sid
+        @return URL path
+        """
+        if self.recording_format == 'mp3':
+            ext = '.mp3'
+        else:
+            ext = ''
+        return '/%s/Accounts/%s/Recordings/%s%s' % (self.api_version, self.account_sid, id, ext)
+
+    def get_resources_list(self, resource_type, page, params=None, stream=False):
         """
         Get list of resources from server: calls, sms messages...
 
         @param resource_type type of resource: call, sms message...
-        @return JSON representation
+        @param page page number
+        @param params dict of list filters: {'Status': 'completed'}
+        @param stream return a PageStream decoding the page while it is
+            read, to be closed with close_page
+        @return JSON representation or PageStream
         """
         if resource_type == 'account':
-            url = '/%s/Accounts.json' % self.api_version
+            url = '/%s/Accounts.json?PageSize=%d&Page=%d' % (self.api_version, self.page_size, page)
         elif resource_type == 'sms_message':
             url = '/%s/Accounts/%s/SMS/Messages.json?PageSize=%d&Page=%d' % (self.api_version, self.account_sid, self.page_size, page)
         else:
             url = '/%s/Accounts/%s/%s.json?PageSize=%d&Page=%d' % (self.api_version, self.account_sid, self.format_url_resource_name(resource_type) + 's', self.page_size, page)
+        if params:
+            url += '&' + urllib.urlencode(params)
         self.debug(url, 2)
-        account = twilio.Account(self.account_sid, self.account_token)
         try:
-            d = simplejson.loads(account.request(url, 'GET'))
-            d = self.test_get_resource(resource_type, d)
+            if stream:
+                with self.metrics.timer('http_request_seconds', type=resource_type, kind='list'):
+                    response = self.client.stream(url)
+                res = PageStream(response, resource_type + 's')
+                # the page attributes come before the resources in the API
+                # responses: the resources are not buffered
+                if res.get('total') is None:
+                    res.close()
+                    raise res.error or TException('no total in %s page' % resource_type)
+                return res
+            data = self.request(url, resource_type, 'list')
+            with self.metrics.timer('json_decode_seconds', type=resource_type):
+                d = self.decoder.loads(data)
             return d
         except Exception, e:
             self.debug(e, 1)
             return None
 
-    def test_get_resource(self, resource_type, d):
-        """
-        Testing different resources by filling them up manually instead 
-        of getting them from the server
-        """
-        if resource_type == 'recording':
-            d['total'] = 1
-            d['num_pages'] = 1
-            d['recordings'] = []
-            recording = {}
-            recording['sid'] = 'REda6f1e11047ebd6fe7a55f120be3a900'
-            recording['account_sid'] = 'ACa8e1bcd8948d695aa731bcc128b772dd'
-            recording['api_version'] = '2010-01-01'
-            recording['call_sid'] = 'CA73ac207638841f3ab868f95b4d201c02'
-            recording['date_created'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            recording['date_updated'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            recording['duration'] = '1'
-            recording['uri'] = ''
-            d['recordings'].append(recording)
-        elif resource_type == 'transcription':
-            d['total'] = 1
-            d['num_pages'] = 1
-            d['transcriptions'] = []
-            resource = {}
-            resource['sid'] = 'ACda6f1e11047ebd6fe7a55f120be3a900'
-            resource['account_sid'] = 'ACa8e1bcd8948d695aa731bcc128b772dd'
-            resource['status'] = 'completed'
-            resource['recording_sid'] = 'REda6f1e11047ebd6fe7a55f120be3a900'
-            resource['date_created'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['date_updated'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['duration'] = '1'
-            resource['transcription_text'] = 'bla bla'
-            resource['price'] = '1'
-            resource['uri'] = ''
-            d['transcriptions'].append(resource)
-        elif resource_type == 'notification':
-            d['total'] = 1
-            d['num_pages'] = 1
-            d['notifications'] = []
-            resource = {}
-            resource['sid'] = 'ACda6f1e11047ebd6fe7a55f120be3a900'
-            resource['account_sid'] = 'ACa8e1bcd8948d695aa731bcc128b772dd'
-            resource['status'] = 'completed'
-            resource['call_sid'] = 'CA97f95df0c70ab2fdbc379b457fa6fbfc'
-            resource['date_created'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['date_updated'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['api_version'] = '2010-01-01'
-            resource['log'] = '1'
-            resource['error_code'] = '1'
-            resource['more_info'] = ''
-            resource['message_text'] = ''
-            resource['message_date'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['request_url'] = ''
-            resource['request_method'] = ''
-            resource['request_variables'] = ''
-            resource['response_headers'] = ''
-            resource['response_body'] = ''
-            resource['uri'] = ''
-            d['notifications'].append(resource)
-        elif resource_type == 'conference':
-            d['total'] = 1
-            d['num_pages'] = 1
-            d['conferences'] = []
-            resource = {}
-            resource['sid'] = 'CFda6f1e11047ebd6fe7a55f120be3a900'
-            resource['friendly_name'] = ''
-            resource['status'] = 'completed'
-            resource['date_created'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['date_updated'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['account_sid'] = 'ACa8e1bcd8948d695aa731bcc128b772dd'
-            resource['uri'] = ''
-            d['conferences'].append(resource)
-        elif resource_type == 'participant':
-            d['total'] = 1
-            d['num_pages'] = 1
-            d['participants'] = []
-            resource = {}
-            resource['call_sid'] = 'CA97f95df0c70ab2fdbc379b457fa6fbfc'
-            resource['conference_sid'] = 'CFda6f1e11047ebd6fe7a55f120be3a900'
-            resource['date_created'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['date_updated'] = 'Fri, 17 Jul 2009 01:52:49 +0000'
-            resource['account_sid'] = 'ACa8e1bcd8948d695aa731bcc128b772dd'
-            resource['muted'] = '0'
-            resource['start_conference_on_enter'] = '0'
-            resource['end_conference_on_exit'] = '0'
-            resource['uri'] = ''
-            d['participants'].append(resource)
-        return d
+    def page_chunks(self, lr, res):
+        """
+        Yield the resources of a page: the whole list, or chunks of
+        stream_chunk_size resources while a streamed page is read. A
+        streamed page failing midway ends early with res.error set.
+
+        @param lr list resource
+        @param res JSON representation or PageStream
+        """
+        if not isinstance(res, PageStream):
+            yield res[lr['type'] + 's']
+            return
+        for chunk in res.chunks(self.stream_chunk_size):
+            yield chunk
+        if res.error:
+            self.debug('%s page stream failed: %s' % (lr['type'], res.error), 1)
+
+    def close_page(self, lr, res):
+        """
+        Close a streamed page: the connection goes back to the pool
+
+        @param lr list resource
+        @param res JSON representation or PageStream
+        """
+        if isinstance(res, PageStream):
+            res.close()
+            self.metrics.inc('http_received_bytes_total', res.response.bytes,
+                             type=lr['type'], kind='list')
 
     def process(self, loop=False):
         """
         Main loop processing new resources and active ones to make sure
         we always have the latest resources data in the DB
 
+        In continuous mode, each resource type is checked at its own 
+        interval: the interval increases while the type has no new 
+        resources and is reset when new resources show up.
+
         @param loop 1 download or continuous
         """
         while not self.stop:
-            for lr in self.list_resources:
-                # process active resources list
-                self.process_active(lr)
-                # check for new resources
-                self.process_new(lr)
-            if not loop:
+            if loop:
+                self.stop_event.wait(self.process_due())
+                continue
+            self.process_types(self.list_resources)
+            if self.download_recordings:
+                # wait for recordings downloads to complete
+                self.downloader.join()
+            break
+
+    def process_due(self):
+        """
+        Process the resource types due and reschedule them: one step of
+        the continuous mode
+
+        @return number of seconds until the next resource type is due
+        """
+        due = self.scheduler.due()
+        lrs = [lr for lr in self.list_resources if lr['type'] in due]
+        self.process_types(lrs)
+        for lr in lrs:
+            self.scheduler.reschedule(lr['type'], bool(lr['activity'] or lr['active']))
+        return self.scheduler.next_due()
+
+    def process_types(self, lrs):
+        """
+        Process active and new resources of some types
+
+        @param lrs list resources to process
+        """
+        if self.download_recordings:
+            self.queue_recordings()
+        with self.metrics.timer('cycle_seconds'):
+            if self.workers > 1:
+                self.process_concurrent(lrs)
+            else:
+                for lr in lrs:
+                    self.process_resource(lr)
+        if self.sql:
+            self.debug('sid cache: %s' % self.sid_cache.stats(), 2)
+        self.debug('http: %s' % self.client.stats(), 2)
+
+    def get_stop(self):
+        return self.stop_event.is_set()
+
+    def set_stop(self, stop):
+        if stop:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
+
+    # setting stop to True wakes up the process loop
+    stop = property(get_stop, set_stop)
+
+    def process_resource(self, lr):
+        """
+        Process active and new resources of one type
+
+        @param lr list resource to process
+        """
+        # process active resources list
+        completed = self.process_active(lr)
+        # check for new resources
+        new = self.process_new(lr)
+        # refresh recent resources
+        updated = self.process_updates(lr)
+        lr['activity'] = completed + new + updated
+        self.metrics.set('active_resources', len(lr['active']), type=lr['type'])
+
+    def process_concurrent(self, lrs):
+        """
+        Process resource types concurrently using a pool of worker threads.
+        Each worker has its own DB session and HTTP connection. With
+        worker_ordering, parent types (accounts, then calls...) are
+        processed before their children.
+
+        @param lrs list resources to process
+        """
+        if self.worker_ordering:
+            groups = self.resource_stages(lrs)
+        else:
+            groups = [lrs]
+        for group in groups:
+            queue = Queue.Queue()
+            for lr in group:
+                queue.put(lr)
+            workers = [Thread(target=self.worker, args=(queue,))
+                       for i in range(min(self.workers, len(group)))]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+
+    def worker(self, queue):
+        """
+        Worker thread processing resource types from a queue
+
+        @param queue queue of list resources
+        """
+        while not self.stop:
+            try:
+                lr = queue.get_nowait()
+            except Queue.Empty:
                 break
-            time.sleep(self.check_frequency)
+            try:
+                self.process_resource(lr)
+            except Exception, e:
+                self.debug('%s worker error: %s' % (lr['type'], traceback.format_exc()), 1)
+                lr['activity'] = 0
+                if self.sql:
+                    self.session.rollback()
+                    lr['pending'] = []
+        if self.sql:
+            # close this thread session
+            self.session.remove()
+
+    def resource_stages(self, lrs):
+        """
+        Group list resources by depth in the relations tree: accounts,
+        then calls, sms messages..., then recordings, notifications, then
+        transcriptions
+
+        @param lrs list resources
+        @return list of list resources groups
+        """
+        def depth(resource_type):
+            parents = [p for i, s, p in self.get_parents(resource_type)]
+            if not parents:
+                return 0
+            return 1 + max(depth(p) for p in parents)
+        stages = {}
+        for lr in lrs:
+            stages.setdefault(depth(lr['type']), []).append(lr)
+        return [stages[d] for d in sorted(stages)]
 
     def process_active(self, lr):
         """
@@ -787,67 +1011,579 @@ class Resources(Thread):
         latest resources data in the DB. We don't add the resource until 
         it is in an end state like 'completed'.
 
+        In batch mode, active resources are settled using list requests
+        filtered by status and date, unless they are fewer than the list
+        requests: one per end status. Resources still active after 
+        active_straggler_age seconds are then polled one by one. Resources
+        active for more than active_max_age seconds are dropped.
+
         @param lr list resource to process
         """
-        for key, res in lr['active'].items():
+        completed = 0
+        active = lr['active']
+        expired, spilled = active.expire()
+        for sid in expired:
+            self.debug('%s: %s active for more than %d seconds - drop it' % (lr['type'], sid, self.active_max_age), 1)
+        if spilled:
+            self.debug('%s: %d spilled active resources expired' % (lr['type'], spilled), 1)
+        completed += len(expired) + spilled
+        batch = (self.active_refresh == 'batch' and lr['type'] in active_filters
+                 and len(active) > len(active_filters[lr['type']][1]))
+        if batch:
+            completed += self.process_active_batch(lr)
+        now = time.time()
+        for sid, first_seen, created, status in active.due(now):
+            if batch and now - first_seen < self.active_straggler_age:
+                continue
             # get resource from server and check for completion
-            res = self.get_resource(lr['type'], res['sid'])
+            res = self.get_resource(lr['type'], sid)
             if res:
                 # if resource status done, add it to DB
                 if not self.active_resource(lr['type'], res):
                     self.debug('%s: %s completed - add it to DB' % (lr['type'], res['sid']), 1)
                     # create object and add it
                     self.add_resource(lr, res)
-                    del lr['active'][key]
+                    self.remove_active(lr, sid)
+                    completed += 1
+                else:
+                    active.update(sid, res['status'])
+        # spilled resources back to memory if room was made
+        active.refill()
         if self.sql:
-            self.session.commit()
+            self.commit(lr)
+        if completed:
+            self.save_checkpoint(lr)
+            self.invalidate_queries(lr)
+        return completed
+
+    def process_active_batch(self, lr):
+        """
+        Settle active resources using list requests filtered by end status
+        and date: Calls.json?Status=completed&StartTime>=YYYY-MM-DD
+        Lists are sorted by creation date, newest first: pages are requested
+        until a resource created before the oldest active one shows up.
+
+        @param lr list resource to process
+        @return number of resources completed
+        """
+        date_filter, statuses = active_filters[lr['type']]
+        # oldest active resource creation date
+        since = lr['active'].oldest() or time.time()
+        date = time.strftime('%Y-%m-%d', time.gmtime(since))
+        completed = 0
+        for status in statuses:
+            params = {date_filter: date}
+            if status:
+                params['Status'] = status
+            page = 0
+            while lr['active']:
+                res = self.get_resources_list(lr['type'], page, params)
+                if not res:
+                    break
+                resources = [r for r in res[lr['type']+'s'] if not self.active_resource(lr['type'], r)]
+                found = lr['active'].find([r['sid'] for r in resources])
+                for r in resources:
+                    if r['sid'] in found:
+                        self.debug('%s: %s completed - add it to DB' % (lr['type'], r['sid']), 1)
+                        self.add_resource(lr, r)
+                        self.remove_active(lr, r['sid'])
+                        completed += 1
+                last = res[lr['type']+'s'][-1:]
+                if res['next_page_uri'] == None or (last and
+                        mktime_tz(parsedate_tz(last[0]['date_created'])) < since):
+                    break
+                page += 1
+        self.debug('%s: %d active settled in batch, %d left' % (lr['type'], completed, len(lr['active'])), 2)
+        return completed
+
+    def add_active(self, lr, resources):
+        """
+        Add resources to the active list: SID, creation time and status
+
+        @param lr list resource
+        @param resources resources JSON
+        """
+        entries = []
+        for r in resources:
+            self.debug('add %s - %s to active list - will add it to DB when completed' % (lr['type'], r['sid']), 1)
+            date = r.get('date_created')
+            entries.append((r['sid'], r.get('status'),
+                            mktime_tz(parsedate_tz(date)) if date else None, None))
+        if entries:
+            lr['active'].add(entries)
+
+    def remove_active(self, lr, sid):
+        """
+        Remove resource from the active list
+
+        @param lr list resource
+        @param sid resource SID
+        """
+        lr['active'].remove(sid)
 
     def process_new(self, lr):
         """
-        Process new resources and add them to DB if their status is done
+        Process new resources and add them to DB if their status is done.
+
+        Once a sync finished, pages are processed until a resource already
+        stored shows up: the older ones are stored. The oldest date
+        processed by a sync is saved in the checkpoint after each page:
+        until the sync finishes, the stored resources are skipped and the
+        pages processed to the end, or to a stored resource older than
+        that date if a previous sync finished.
 
         @param lr list resource to process
         """
+        if (self.sync_mode == 'watermark' and lr['type'] in watermark_filters
+                and lr['last_date_created']):
+            return self.process_new_watermark(lr)
         page = 0
-        res = self.get_resources_list(lr['type'], page)
+        res = self.fetch_page(lr, page, stream=self.stream_pages)
         # check if we have more items to process
-        if res and res['total'] > lr['items']:
-            count = res['total'] - lr['items']
+        if res and (res['total'] > lr['items'] or lr['resume']):
+            total = res['total']
+            count = total - lr['items']
             self.debug('processing %d new %ss' % (count, lr['type']), 1)
             items = 0
-            while True:
-                sitems = 0
-                if res:
-                    for r in res[lr['type']+'s']:
-                        print r
-                        # process resources received
-                        # if active resource, add it to the active list
-                        # if not, add to DB
-                        if self.active_resource(lr['type'], r):
-                            if r['sid'] in lr['active']:
-                                break
-                            self.debug('add %s - %s to active list - will add it to DB when completed' % (lr['type'], r['sid']), 1)
-                            lr['active'][r['sid']] = r
-                        else:
-                            if self.add_resource(lr, r) == False:
+            newest = None
+            newest_sids = set()
+            oldest = None
+            done = False
+            prefetcher = None
+            if self.prefetch_pages and not self.stream_pages and res.get('num_pages', 0) > 1:
+                # fetch next pages while we write this one
+                prefetcher = PagePrefetcher(lambda p: self.fetch_page(lr, p),
+                    1, res['num_pages'], self.prefetch_pages)
+            try:
+                while True:
+                    if not res:
+                        # page failed: resume next cycle
+                        self.debug('%s page %d failed - stop' % (lr['type'], page), 1)
+                        break
+                    try:
+                        for resources in self.page_chunks(lr, res):
+                            if not resources:
+                                continue
+                            if page == 0:
+                                # newest resource, saved once all pages are processed
+                                top = max(resources, key=lambda r: convert_rfc822_to_datetime(r['date_created']))
+                                if not newest or (convert_rfc822_to_datetime(top['date_created']) >
+                                                  convert_rfc822_to_datetime(newest['date_created'])):
+                                    newest, newest_sids = top, set()
+                                newest_sids.update(r['sid'] for r in resources
+                                                   if r['date_created'] == newest['date_created'])
+                            trusted = self.stored_contiguous(lr, resources)
+                            lr['caught_up'] = False
+                            if self.bulk_insert:
+                                processed = self.process_page_bulk(lr, resources)
+                            else:
+                                processed = self.process_page(lr, resources, stop_at_existing=trusted)
+                            items += len(processed)
+                            oldest = resources[-1]['date_created']
+                            if self.sql:
+                                self.commit(lr)
+                            if processed:
+                                self.invalidate_queries(lr)
+                            self.debug('%d / %d' % (items, count), 1)
+                            # process resources dependencies
+                            self.process_resources_dependencies(lr, processed)
+                            # the count is only reliable if the list did not change
+                            if (trusted and lr['caught_up']) or (items >= count and res['total'] == total):
+                                done = True
                                 break
-                        items += 1
-                        sitems += 1
-                    if self.sql:
-                        self.session.commit()
-                    self.debug('%d / %d' % (items, count), 1)
-                    # process resources dependencies
-                    self.process_resources_dependencies(lr, res[lr['type']+'s'][:sitems])
+                    finally:
+                        self.close_page(lr, res)
+                    if getattr(res, 'error', None) and not done:
+                        # page read partially: resume next cycle
+                        break
                     # process next page if any
-                    if res['next_page_uri'] == None:
+                    if done or res['next_page_uri'] == None:
                         lr['items'] += count
+                        lr['resume'] = None
+                        if newest:
+                            lr['last_sid'] = newest['sid']
+                            lr['last_date_created'] = newest['date_created']
+                            lr['watermark_sids'] = newest_sids
                         self.debug('save items: %d' % (lr['items']), 2)
+                        self.save_checkpoint(lr)
                         break
                     else:
+                        if oldest and (not lr['resume'] or convert_rfc822_to_datetime(oldest) <
+                                                            convert_rfc822_to_datetime(lr['resume'])):
+                            # the resources older than oldest are left
+                            lr['resume'] = oldest
+                            self.save_checkpoint(lr)
                         self.debug('get next page', 2)
                         page += 1
-                        res = self.get_resources_list(lr['type'], page)
+                        if prefetcher:
+                            res = prefetcher.get(page)
+                        else:
+                            res = self.fetch_page(lr, page, stream=self.stream_pages)
+            finally:
+                if prefetcher:
+                    prefetcher.close()
+            return items
+        self.close_page(lr, res)
+        return 0
+
+    def stored_contiguous(self, lr, resources):
+        """
+        Are all the resources older than the first stored one of these
+        resources stored? True once a sync finished, for the resources
+        older than the resume date if a sync was interrupted since. The
+        first sync may follow one interrupted before saving a checkpoint.
+
+        @param lr list resource
+        @param resources resources JSON, newest first
+        @return True/False
+        """
+        if not lr['items']:
+            return False
+        if not lr['resume']:
+            return True
+        resume = convert_rfc822_to_datetime(lr['resume'])
+        return all(convert_rfc822_to_datetime(r['date_created']) < resume for r in resources)
+
+    def process_new_watermark(self, lr):
+        """
+        Process resources created since the newest one seen: the watermark.
+        Only the resources with a date on or after the watermark day are 
+        requested. Resources created at the watermark are deduped by SID. 
+        Pages are processed until a resource created watermark_margin 
+        seconds before the watermark shows up: a queued SMS message has no
+        DateSent and a queued call no StartTime, they are only listed once
+        sent or started, after newer resources. The resources created 
+        within the margin are deduped by the page existence check.
+
+        @param lr list resource to process
+        @return number of resources processed
+        """
+        watermark = convert_rfc822_to_datetime(lr['last_date_created'])
+        since = watermark - timedelta(seconds=self.watermark_margin)
+        params = {watermark_filters[lr['type']]: since.strftime('%Y-%m-%d')}
+        newest, newest_sids = watermark, set(lr['watermark_sids'])
+        newest_resource = None
+        items = 0
+        page = 0
+        while True:
+            res = self.fetch_page(lr, page, params, self.stream_pages)
+            if not res:
+                # page failed: keep the watermark, try again next cycle
+                self.debug('%s page %d failed - stop' % (lr['type'], page), 1)
+                return items
+            older = False
+            try:
+                for resources in self.page_chunks(lr, res):
+                    new = []
+                    for r in resources:
+                        date = convert_rfc822_to_datetime(r['date_created'])
+                        if date < since:
+                            older = True
+                            continue
+                        if date == watermark and r['sid'] in lr['watermark_sids']:
+                            continue
+                        new.append(r)
+                        if date > newest:
+                            newest, newest_resource, newest_sids = date, r, set()
+                        if date == newest:
+                            newest_sids.add(r['sid'])
+                    if new:
+                        if self.bulk_insert:
+                            processed = self.process_page_bulk(lr, new)
+                        else:
+                            processed = self.process_page(lr, new, stop_at_existing=False)
+                        items += len(processed)
+                        if self.sql:
+                            self.commit(lr)
+                        if processed:
+                            self.invalidate_queries(lr)
+                        self.process_resources_dependencies(lr, processed)
+            finally:
+                self.close_page(lr, res)
+            if getattr(res, 'error', None):
+                # page read partially: keep the watermark
+                return items
+            if older or res['next_page_uri'] == None:
+                break
+            page += 1
+        lr['watermark_sids'] = newest_sids
+        if newest_resource:
+            lr['last_sid'] = newest_resource['sid']
+            lr['last_date_created'] = newest_resource['date_created']
+        if items or newest_resource:
+            self.debug('%s: %d new, watermark %s' % (lr['type'], items, lr['last_date_created']), 1)
+            lr['items'] += items
+            self.save_checkpoint(lr)
+        return items
+
+    def process_updates(self, lr):
+        """
+        Refresh the resources created in the last update_window seconds,
+        every update_frequency seconds: prices, durations... are often set
+        after the resource is added. Only the resources with a content 
+        hash different from the one in the DB are written.
+
+        @param lr list resource to process
+        @return number of resources updated
+        """
+        if not self.update_window or not lr['type'] in watermark_filters:
+            return 0
+        now = time.time()
+        if now - lr['refreshed'] < self.update_frequency:
+            return 0
+        lr['refreshed'] = now
+        since = datetime.utcfromtimestamp(now - self.update_window)
+        params = {watermark_filters[lr['type']]: since.strftime('%Y-%m-%d')}
+        updated = 0
+        page = 0
+        while True:
+            res = self.fetch_page(lr, page, params, self.stream_pages)
+            if not res:
+                self.debug('%s page %d failed - stop' % (lr['type'], page), 1)
+                break
+            older = False
+            try:
+                for chunk in self.page_chunks(lr, res):
+                    resources = []
+                    for r in chunk:
+                        if convert_rfc822_to_datetime(r['date_created']) < since:
+                            older = True
+                        elif not self.active_resource(lr['type'], r):
+                            resources.append(r)
+                    updated += self.update_resources(lr, resources)
+            finally:
+                self.close_page(lr, res)
+            if older or getattr(res, 'error', None) or res['next_page_uri'] == None:
+                break
+            page += 1
+        if updated:
+            self.debug('%s: %d updated' % (lr['type'], updated), 1)
+            self.invalidate_queries(lr)
+        return updated
+
+    def update_resources(self, lr, resources):
+        """
+        Write the resources which changed: content hash different from
+        the one in the DB. Resources not in the DB are left to 
+        process_new.
+
+        @param lr list resource
+        @param resources resources JSON
+        @return number of resources updated
+        """
+        if not resources:
+            return 0
+        spec = specs[lr['type']]
+        sids = [r['sid'] for r in resources]
+        if self.sql:
+            from sqlalchemy import select, bindparam
+            table = self.tables[lr['type']]
+            stored = dict(self.session.execute(select([table.c.sid, table.c[hash_column]])
+                                               .where(table.c.sid.in_(sids))).fetchall())
+            rows = []
+            for r in resources:
+                if r['sid'] in stored and spec.convert(r)[-1] != stored[r['sid']]:
+                    row = dict(zip(spec.columns, self.resource_row(lr, r)))
+                    row['_sid'] = row.pop('sid')
+                    rows.append(row)
+            if rows:
+                self.session.execute(table.update().where(table.c.sid == bindparam('_sid')), rows)
+                self.session.commit()
+            return len(rows)
+        pipe = self.redis.pipeline(transaction=False)
+        keys = [self.get_resource_key(lr, r) for r in resources]
+        updated = 0
+        for key, r, v in zip(keys, resources, self.redis.mget(keys)):
+            if v and spec.convert(r)[-1] != spec.convert(self.serializer.loads(v))[-1]:
+                pipe.set(key, self.serializer.dumps(r))
+                updated += 1
+        if updated:
+            pipe.execute()
+        return updated
+
+    def fetch_page(self, lr, page, params=None, stream=False):
+        """
+        Get page of resources from server, retry if the request fails
+
+        @param lr list resource
+        @param page page number
+        @param params dict of list filters
+        @param stream return a PageStream, see get_resources_list
+        @return JSON representation, PageStream or None
+        """
+        for i in range(self.page_retries + 1):
+            res = self.get_resources_list(lr['type'], page, params, stream)
+            if res:
+                return res
+            self.debug('%s page %d failed - attempt %d' % (lr['type'], page, i + 1), 1)
+        return None
+
+    def process_page(self, lr, resources, stop_at_existing=True):
+        """
+        Add a page of resources to the DB one by one, stop at the first
+        one already in the DB
+
+        @param lr list resource
+        @param resources resources JSON
+        @param stop_at_existing False to skip the resources already in the
+            DB and process the rest of the page
+        @return resources processed
+        """
+        processed = []
+        # resolve which resources of the page are already in the DB or in
+        # the active list
+        existing = self.existing_resources(lr, [r['sid'] for r in resources
+            if 'sid' in r and not self.active_resource(lr['type'], r)])
+        known = lr['active'].find([r['sid'] for r in resources
+            if self.active_resource(lr['type'], r)])
+        active = []
+        if self.sql:
+            self.prefetch_parent_ids(lr, [r for r in resources
+                if not r.get('sid') in existing])
+        inserted = 0
+        for r in resources:
+            # process resources received
+            # if active resource, add it to the active list
+            # if not, add to DB
+            if self.active_resource(lr['type'], r):
+                if r['sid'] in known:
+                    if stop_at_existing:
+                        lr['caught_up'] = True
+                        break
+                    continue
+                known.add(r['sid'])
+                active.append(r)
+            else:
+                if self.add_resource(lr, r, r.get('sid') in existing) == False:
+                    self.metrics.inc('rows_skipped_total', type=lr['type'])
+                    if stop_at_existing:
+                        lr['caught_up'] = True
+                        break
+                    continue
+                inserted += 1
+            processed.append(r)
+        self.add_active(lr, active)
+        self.metrics.inc('rows_inserted_total', inserted, type=lr['type'])
+        return processed
+
+    def process_page_bulk(self, lr, resources):
+        """
+        Add a page of resources to the DB with a single multi-row insert
+        (SQL) or a single pipelined round trip (Redis). Duplicates are 
+        resolved by the sid unique constraint or SETNX, they set 
+        lr['caught_up'] (not detected on MySQL: found rows are counted).
+
+        @param lr list resource
+        @param resources resources JSON
+        @return resources processed
+        """
+        active = [r for r in resources if self.active_resource(lr['type'], r)]
+        known = lr['active'].find([r['sid'] for r in active])
+        if known:
+            lr['caught_up'] = True
+        self.add_active(lr, [r for r in active if not r['sid'] in known])
+        processed = [r for r in resources if not self.active_resource(lr['type'], r)]
+        if not self.sql:
+            inserted = self.write_resources_redis(lr, processed)
+            if inserted < len(processed):
+                lr['caught_up'] = True
+            self.debug('%s page: %d inserted / %d' % (lr['type'], inserted, len(processed)), 2)
+            self.metrics.inc('rows_inserted_total', inserted, type=lr['type'])
+            self.metrics.inc('rows_skipped_total', len(processed) - inserted, type=lr['type'])
+            return processed
+        table = self.tables[lr['type']]
+        if not table.c.sid.unique:
+            # no constraint to resolve duplicates: check first
+            existing = self.existing_resources(lr, [r['sid'] for r in processed])
+            if existing:
+                lr['caught_up'] = True
+            processed = [r for r in processed if not r['sid'] in existing]
+        self.prefetch_parent_ids(lr, processed)
+        # rows are plain tuples until the statement is built
+        rows = [self.resource_row(lr, r) for r in processed]
+        inserted = self.insert_rows(table, specs[lr['type']].columns, rows)
+        if inserted < len(rows) and self.database_type != 'mysql':
+            lr['caught_up'] = True
+        self.debug('%s page: %d inserted / %d' % (lr['type'], inserted, len(rows)), 2)
+        self.metrics.inc('rows_inserted_total', inserted, type=lr['type'])
+        self.metrics.inc('rows_skipped_total', len(rows) - inserted, type=lr['type'])
+        return processed
+
+    def write_resources_redis(self, lr, resources):
+        """
+        Write resources to Redis in one pipelined round trip using SETNX
+        so existing resources are left untouched
+
+        @param lr list resource
+        @param resources resources JSON
+        @return number of resources written
+        """
+        if not resources:
+            return 0
+        pipe = self.redis.pipeline(transaction=False)
+        for r in resources:
+            pipe.setnx(self.get_resource_key(lr, r), self.serializer.dumps(r))
+        for r in resources:
+            self.index_resource_redis(pipe, lr, r)
+        return len([x for x in pipe.execute()[:len(resources)] if x])
+
+    def index_resource_redis(self, redis, lr, resource):
+        """
+        Add resource to the account resources index: sorted set with
+        members '<date created> <sid>' read by ResourceQuery
 
+        @param redis Redis client or pipeline
+        @param lr list resource
+        @param resource resource JSON
+        """
+        date = convert_rfc822_to_datetime(resource.get('date_created'))
+        if date is None:
+            return
+        key = self.get_index_key(resource.get('account_sid') or self.account_sid, lr['type'])
+        redis.zadd(key, {'%s %s' % (date.strftime(sortable_date_format), resource['sid']): 0})
+
+    def resource_row(self, lr, resource):
+        """
+        Convert resource to a row tuple of its table, set relations
+
+        @param lr list resource
+        @param resource resource JSON
+        @return tuple of values in the resource spec columns order
+        """
+        for id_key, sid_key, parent_type in self.get_parents(lr['type']):
+            resource[id_key] = self.get_parent_id(parent_type, resource[sid_key])
+        return specs[lr['type']].convert(resource)
+
+    def insert_rows(self, table, columns, rows):
+        """
+        Insert rows with a single multi-row insert, skip the ones with
+        a sid already in the table:
+        PostgreSQL: INSERT ... ON CONFLICT DO NOTHING
+        MySQL: INSERT ... ON DUPLICATE KEY UPDATE sid = sid
+        SQLite: INSERT OR IGNORE ..., one statement executed for each row
+
+        @param table SQLAlchemy table
+        @param columns columns names
+        @param rows list of row tuples
+        @return number of rows inserted (MySQL: rows inserted or found)
+        """
+        if not rows:
+            return 0
+        rows = [dict(zip(columns, row)) for row in rows]
+        if self.database_type == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table).values(rows).on_conflict_do_nothing()
+        elif self.database_type == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(table).values(rows)
+            stmt = stmt.on_duplicate_key_update(sid=stmt.inserted.sid)
+        elif self.database_type == 'sqlite':
+            # embedded: executemany of a single prepared statement is 
+            # faster than compiling a multi-row insert
+            return self.session.execute(table.insert().prefix_with('OR IGNORE'), rows).rowcount
+        else:
+            stmt = table.insert().values(rows)
+        return self.session.execute(stmt).rowcount
 
     def active_resource(self, resource_type, resource):
         """
@@ -856,48 +1592,117 @@ class Resources(Thread):
         @param resource_type type of resource: call, sms...
         @return True if resource is active or False if not
         """
-        if (resource_type in ('call', 'transcription', 'conference', 'sms_message') and
+        if (resource_type in active_types and
                 resource['status'] in ('queued', 'ringing', 'in-progress', 'init', 'sending')):
                 return True
         return False
         
-    def add_resource(self, lr, resource):
+    def add_resource(self, lr, resource, exists=None):
         """
         Add resource object to DB. Set relations.
 
         @param lr list resource
         @param resource resource JSON
+        @param exists True/False if already known from a page-level check,
+            None to query the DB
         """
         # check if resource is in DB
-        if self.resource_exists(lr, resource):
+        if exists is None:
+            exists = self.resource_exists(lr, resource)
+        if exists:
             return False
         if self.sql:
-            # if object has a relation with another object, set it
-            if lr['type'] != 'account':
-                # get account id
-                account = self.session.query(Account).filter_by(sid=resource['account_sid'])[0]
-                resource['account_id'] = account.id
-            if lr['type'] in ('recording', 'notification'):
-                # get call id
-                call = self.session.query(Call).filter_by(sid=resource['call_sid'])[0]
-                resource['call_id'] = call.id
-            elif lr['type'] == 'transcription':
-                # get recording id
-                recording = self.session.query(Recording).filter_by(sid=resource['recording_sid'])[0]
-                resource['recording_id'] = recording.id
-            elif lr['type'] == 'participant':
-                # get call and conference id 
-                call = self.session.query(Call).filter_by(sid=resource['call_sid'])[0]
-                resource['call_id'] = call.id
-                conference = self.session.query(Conference).filter_by(sid=resource['conference_sid'])[0]
-                resource['conference_id'] = conference.id
-            # create object and add it
-            o = lr['cls'](resource)
-            self.session.add(o)
-        else:
-            self.redis.set(self.get_resource_key(lr, resource), resource)
+            # compact record with its relations set, inserted on commit
+            lr['pending'].append(specs[lr['type']].record_class(*self.resource_row(lr, resource)))
+        else:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(self.get_resource_key(lr, resource), self.serializer.dumps(resource))
+            self.index_resource_redis(pipe, lr, resource)
+            pipe.execute()
         return True
 
+    def get_parents(self, resource_type):
+        """
+        Return foreign keys of a resource type
+
+        @param resource_type type of resource: call, sms...
+        @return list of (id attribute, sid attribute, parent type)
+        """
+        return specs[resource_type].parents
+
+    def get_parent_id(self, resource_type, sid):
+        """
+        Return row id of a parent resource, from the cache if possible
+
+        @param resource_type type of parent resource: account, call...
+        @param sid parent resource SID
+        @return row id or None if parent is not in the DB
+        """
+        if not sid:
+            return None
+        id = self.sid_cache.get((resource_type, sid))
+        if id is None:
+            cls = self.resource_classes[resource_type]
+            with self.metrics.timer('fk_lookup_seconds', type=resource_type):
+                row = self.session.query(cls.id).filter_by(sid=sid).first()
+            if not row:
+                self.debug('%s %s not found' % (resource_type, sid), 1)
+                return None
+            id = row[0]
+            self.sid_cache.put((resource_type, sid), id)
+        return id
+
+    def prefetch_parent_ids(self, lr, resources):
+        """
+        Load row ids of the parents of a page of resources missing from
+        the cache using one query per parent type
+
+        @param lr list resource
+        @param resources resources JSON
+        """
+        missing = {}
+        for id_key, sid_key, parent_type in self.get_parents(lr['type']):
+            for r in resources:
+                sid = r.get(sid_key)
+                if sid and not (parent_type, sid) in self.sid_cache:
+                    missing.setdefault(parent_type, set()).add(sid)
+        for parent_type, sids in missing.items():
+            cls = self.resource_classes[parent_type]
+            with self.metrics.timer('fk_lookup_seconds', type=parent_type):
+                for sid, id in self.session.query(cls.sid, cls.id).filter(cls.sid.in_(list(sids))):
+                    self.sid_cache.put((parent_type, sid), id)
+
+    def commit(self, lr=None):
+        """
+        Insert the records pending and commit session
+
+        @param lr list resource with records pending
+        """
+        with self.metrics.timer('commit_seconds', type=lr['type'] if lr else 'checkpoint'):
+            if lr and lr['pending']:
+                self.insert_records(lr)
+            self.session.commit()
+
+    def insert_records(self, lr):
+        """
+        Insert the records pending with a single executemany and cache the
+        row ids of the parent types (accounts, calls...)
+
+        @param lr list resource with records pending
+        """
+        from sqlalchemy import select
+        table = self.tables[lr['type']]
+        columns = specs[lr['type']].columns
+        records, lr['pending'] = lr['pending'], []
+        # dicts only built for the statement
+        self.session.execute(table.insert(),
+            [dict((c, getattr(rec, c)) for c in columns) for rec in records])
+        if lr['type'] in parent_types:
+            with self.metrics.timer('fk_lookup_seconds', type=lr['type']):
+                for sid, id in self.session.execute(select([table.c.sid, table.c.id])
+                        .where(table.c.sid.in_([rec.sid for rec in records]))):
+                    self.sid_cache.put((lr['type'], sid), id)
+
     def resource_exists(self, lr, resource):
         """
         Check if a resource exists in the DB
@@ -907,13 +1712,40 @@ class Resources(Thread):
         @return True if exists, False if not
         """
         if 'sid' in resource:
+            with self.metrics.timer('exists_check_seconds', type=lr['type']):
+                if self.sql:
+                    exists = self.session.query(lr['cls']).filter_by(sid=resource['sid']).count()
+                else:
+                    exists = self.redis.get(self.get_resource_key(lr, resource))
+            if exists:
+                return True
+        return False
+
+    def existing_resources(self, lr, sids):
+        """
+        Check which resources of a page exist in the DB using a single 
+        query (SQL) or a single pipelined round trip (Redis)
+
+        @param lr list resource
+        @param sids list of resources SIDs
+        @return set of SIDs already in the DB
+        """
+        if not sids:
+            return set()
+        with self.metrics.timer('exists_check_seconds', type=lr['type']):
             if self.sql:
-                if self.session.query(lr['cls']).filter_by(sid=resource['sid']).count():
-                    return True
+                cls = lr['cls']
+                existing = set(row[0] for row in 
+                    self.session.query(cls.sid).filter(cls.sid.in_(sids)))
             else:
-                if self.redis.get(self.get_resource_key(lr, resource)):
-                    return True
-        return False
+                pipe = self.redis.pipeline(transaction=False)
+                for sid in sids:
+                    pipe.exists(self.get_resource_key(lr, dict(sid=sid)))
+                existing = set(sid for sid, e in zip(sids, pipe.execute()) if e)
+        saved = len(sids) - 1
+        self.round_trips_saved += saved
+        self.debug('%s page: %d existing / %d - %d round trips saved (total: %d)' % (lr['type'], len(existing), len(sids), saved, self.round_trips_saved), 2)
+        return existing
 
     def process_resources_dependencies(self, lr, resources):
         """
@@ -928,11 +1760,34 @@ class Resources(Thread):
             if lr['type'] == 'recording' and self.download_recordings:
                 self.debug('downloading %d recordings' % (len(resources)), 1)
                 for res in resources:
-                    data = self.get_resource(lr['type'], res['sid'])
-                    if data:
-                        f = open(self.recording_path+'/'+res['sid'], 'w+')
-                        f.write(data)
-                        f.close
+                    self.downloader.add(res['sid'])
+
+    def queue_recordings(self):
+        """
+        Queue the downloads failed during the previous cycles. At the
+        first cycle, queue the recordings stored by a previous run with
+        a missing or partial audio file: they are not processed again.
+        """
+        if self.recordings_checked:
+            self.downloader.retry()
+            return
+        self.recordings_checked = True
+        if self.resource_types and not 'recording' in self.resource_types:
+            return
+        if self.sql:
+            table = self.tables['recording']
+            from sqlalchemy import select
+            sids = [row[0] for row in self.session.execute(select([table.c.sid])
+                    .where(table.c.accountSid == self.account_sid))]
+            self.session.commit()
+        else:
+            sids = [member.split(' ')[1] for member in
+                    self.redis.zrange(self.get_index_key(self.account_sid, 'recording'), 0, -1)]
+        sids = [sid for sid in sids if self.downloader.missing(sid)]
+        if sids:
+            self.debug('downloading %d recordings missing' % len(sids), 1)
+            for sid in sids:
+                self.downloader.add(sid)
 
     def get_resource_key(self, lr, resource):
         """
@@ -943,6 +1798,57 @@ class Resources(Thread):
         """
         return '%s' % resource['sid']
 
+    def stats(self):
+        """
+        Statistics snapshot
+
+        @return dict: metrics (counters, gauges, timers), http, sid_cache,
+            recordings (if downloaded), active (number of active resources
+            per type)
+        """
+        d = dict(metrics=self.metrics.snapshot(), http=self.client.stats(),
+                 sid_cache=self.sid_cache.stats(),
+                 active=dict((lr['type'], len(lr['active'])) for lr in self.list_resources))
+        if self.download_recordings:
+            d['recordings'] = self.downloader.stats()
+        return d
+
+    def prometheus(self):
+        """
+        Metrics in the Prometheus text format, including the HTTP client 
+        and recordings downloads counters
+
+        @return text
+        """
+        lines = [self.metrics.prometheus()]
+        prefix = self.metrics.prefix
+        counters = [('http', self.client.stats())]
+        if self.download_recordings:
+            counters.append(('recordings', self.downloader.stats()))
+        for name, stats in counters:
+            for k, v in sorted(stats.items()):
+                lines.append('# TYPE %s_%s_%s gauge\n%s_%s_%s %s\n' % (prefix, name, k, prefix, name, k, v))
+        return ''.join(lines)
+
+    def get_index_key(self, account_sid, resource_type):
+        """
+        Return resources index key
+
+        @param account_sid account SID
+        @param resource_type type of resource: call, sms...
+        """
+        return 'index:%s:%s' % (account_sid, resource_type)
+
+    def invalidate_queries(self, lr):
+        """
+        Invalidate queries cached results of a resource type: new 
+        resources were written
+
+        @param lr list resource
+        """
+        for q in self.queries:
+            q.invalidate(lr['type'])
+
     def format_url_resource_name(self, name):
         """
         Format resource name to be used in URL: incoming_phone_number = IncomingPhoneNumber
@@ -973,18 +1879,7 @@ class Resources(Thread):
         @param level debug level: 0 = nothing, 1 = info, 2 = dev
         """
         if self.dbg_level >= level:
-            print s
-
-def convert_rfc822_to_mysql_datetime(str):
-    """
-    Convert RFC 822 date to MySQL datetime
-
-    'Fri, 17 Jul 2009 01:52:49 +0000' -> '2009-07-17 01:52:49'
-    @param str RFC 822 date string
-    @returns MySQL date string
-    """
-    d = parsedate(str)
-    return '%d-%d-%d %02d:%02d:%02d' % (d[0], d[1], d[2], d[3], d[4], d[5])
+            logger.log(logging.INFO if level <= 1 else logging.DEBUG, s)
 
 class TException(Exception): pass
 
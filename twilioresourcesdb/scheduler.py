@@ -0,0 +1,69 @@
+import heapq
+import time
+
+class Scheduler(object):
+    """
+    Per resource type polling scheduler. The interval of a type is
+    increased exponentially while it has no new resources and reset when
+    new resources show up. Next due times are kept in a priority queue.
+    """
+    def __init__(self, intervals, max_interval, backoff=2.0):
+        """
+        Class instantiation: all types are due now
+
+        @param intervals dict resource type -> base interval in seconds
+        @param max_interval maximum interval in seconds
+        @param backoff interval multiplier when a type has no new resources
+        """
+        self.base = dict(intervals)
+        self.intervals = dict(intervals)
+        self.max_interval = max_interval
+        self.backoff = backoff
+        now = time.time()
+        self.queue = [(now, t) for t in intervals]
+        heapq.heapify(self.queue)
+
+    def due(self, now=None):
+        """
+        Pop resource types due
+
+        @param now current time
+        @return list of resource types
+        """
+        if now is None:
+            now = time.time()
+        types = []
+        while self.queue and self.queue[0][0] <= now:
+            types.append(heapq.heappop(self.queue)[1])
+        return types
+
+    def next_due(self, now=None):
+        """
+        Return number of seconds until the next resource type is due
+
+        @param now current time
+        @return seconds, 0 if a type is due, None if nothing is scheduled
+        """
+        if not self.queue:
+            return None
+        if now is None:
+            now = time.time()
+        return max(0, self.queue[0][0] - now)
+
+    def reschedule(self, resource_type, activity, now=None):
+        """
+        Schedule next check of a resource type
+
+        @param resource_type type of resource: call, sms...
+        @param activity True if the type had new or completed resources
+        @param now current time
+        """
+        if now is None:
+            now = time.time()
+        if activity:
+            interval = self.base[resource_type]
+        else:
+            interval = min(self.intervals[resource_type] * self.backoff,
+                           max(self.max_interval, self.base[resource_type]))
+        self.intervals[resource_type] = interval
+        heapq.heappush(self.queue, (now + interval, resource_type))
@@ -0,0 +1,81 @@
+import zlib
+
+import simplejson
+
+class JsonSerializer(object):
+    """
+    JSON serializer: compact separators, readable from any language
+    """
+    name = 'json'
+
+    def dumps(self, resource):
+        """
+        Encode resource
+
+        @param resource resource JSON attribute
+        @return encoded string
+        """
+        return simplejson.dumps(resource, separators=(',', ':'))
+
+    def loads(self, data):
+        """
+        Decode resource
+
+        @param data encoded string
+        @return resource JSON attribute
+        """
+        return simplejson.loads(data)
+
+class ZlibJsonSerializer(JsonSerializer):
+    """
+    zlib compressed JSON serializer
+    """
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        """
+        Class instantiation
+
+        @param level zlib compression level: 1 (fast) to 9 (small)
+        """
+        self.level = level
+
+    def dumps(self, resource):
+        return zlib.compress(JsonSerializer.dumps(self, resource), self.level)
+
+    def loads(self, data):
+        return JsonSerializer.loads(self, zlib.decompress(data))
+
+class MsgpackSerializer(object):
+    """
+    MessagePack serializer (requires msgpack)
+    """
+    name = 'msgpack'
+
+    def __init__(self):
+        """
+        Class instantiation
+        """
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, resource):
+        return self.msgpack.packb(resource, use_bin_type=True)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, raw=False)
+
+serializers = dict((c.name, c) for c in
+                   (JsonSerializer, ZlibJsonSerializer, MsgpackSerializer))
+
+def get_serializer(serializer):
+    """
+    Return serializer instance
+
+    @param serializer serializer name: 'json', 'zlib', 'msgpack' or object
+        with dumps/loads methods
+    @return serializer instance
+    """
+    if not isinstance(serializer, basestring):
+        return serializer
+    return serializers[serializer]()
@@ -0,0 +1,336 @@
+import hashlib
+
+from dates import convert_rfc822_to_datetime
+
+# column storing the hash of the resource content
+hash_column = 'contentHash'
+
+class Field(object):
+    """
+    Resource field: table column and JSON attribute
+    """
+    __slots__ = ('name', 'key', 'kind', 'length', 'parent')
+
+    def __init__(self, name, key, kind, length=None, parent=None):
+        """
+        Class instantiation
+
+        @param name column name
+        @param key JSON attribute
+        @param kind 'string', 'text', 'integer', 'boolean', 'datetime' or
+            'id' (row id of a parent resource)
+        @param length string length
+        @param parent parent resource type of an 'id' field
+        """
+        self.name = name
+        self.key = key
+        self.kind = kind
+        self.length = length
+        self.parent = parent
+
+class ResourceSpec(object):
+    """
+    Resource type specification: generates the table, the mapped class,
+    the compact record class and the JSON to row converter
+    """
+    def __init__(self, type, class_name, table, fields, indexes=()):
+        """
+        Class instantiation
+
+        @param type resource type: call, sms_message...
+        @param class_name mapped class name: Call, SmsMessage...
+        @param table table name
+        @param fields list of Field, sid first if the resource has one
+        @param indexes columns names tuple of each index, sid is indexed
+            by its unique constraint
+        """
+        self.type = type
+        self.class_name = class_name
+        self.table = table
+        self.fields = fields
+        self.indexes = indexes
+        # content hash is the last column
+        self.columns = tuple(f.name for f in fields) + (hash_column,)
+        # JSON key of the field identifying a resource
+        self.key = fields[0].key
+        self.converters = tuple((f.key, convert_rfc822_to_datetime if f.kind == 'datetime' else None)
+                                for f in fields)
+        # (id attribute, sid attribute, parent type) of each foreign key
+        self.parents = tuple((f.key, f.key[:-3] + '_sid', f.parent)
+                             for f in fields if f.kind == 'id')
+        # fields hashed: relations are not part of the resource content
+        self.hashed = tuple(i for i, f in enumerate(fields) if f.kind != 'id')
+        self.record_class = make_record_class(self)
+
+    def convert(self, resource):
+        """
+        Convert resource JSON to a row tuple, in columns order
+
+        @param resource resource JSON attribute
+        @return tuple of values, content hash last
+        """
+        get = resource.get
+        values = tuple(c(get(k)) if c else get(k) for k, c in self.converters)
+        return values + (self.content_hash(values),)
+
+    def content_hash(self, values):
+        """
+        Return compact hash of the resource content: fields values except
+        relations
+
+        @param values fields values
+        @return 16 hex digits
+        """
+        content = u'\x1f'.join(u'' if values[i] is None else unicode(values[i]) for i in self.hashed)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+    def record(self, resource):
+        """
+        Convert resource JSON to a compact record
+
+        @param resource resource JSON attribute
+        @return record
+        """
+        return self.record_class(*self.convert(resource))
+
+    def make_table(self, metadata):
+        """
+        Create table
+
+        @param metadata SQLAlchemy metadata
+        @return SQLAlchemy table
+        """
+        from sqlalchemy import Table, Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Index
+        types = dict(text=Text, integer=Integer, boolean=Boolean, datetime=DateTime)
+        columns = [Column('id', Integer, primary_key=True)]
+        for f in self.fields:
+            if f.kind == 'string':
+                column = Column(f.name, String(f.length), unique=(f.name == 'sid'))
+            elif f.kind == 'id':
+                column = Column(f.name, Integer, ForeignKey('%s.id' % specs[f.parent].table))
+            else:
+                column = Column(f.name, types[f.kind])
+            columns.append(column)
+        columns.append(Column(hash_column, String(16)))
+        indexes = [Index(index_name(self.table, c), *c) for c in self.indexes]
+        return Table(self.table, metadata, *(columns + indexes))
+
+    def make_class(self):
+        """
+        Create class mapped to the table: instantiated with the resource
+        JSON attribute
+
+        @return class
+        """
+        spec = self
+        def __init__(self, resource):
+            for name, value in zip(spec.columns, spec.convert(resource)):
+                setattr(self, name, value)
+        def __repr__(self):
+            return "<%s('%s')>" % (spec.type, getattr(self, spec.columns[0]))
+        return type(self.class_name, (object,), dict(__init__=__init__,
+            __repr__=__repr__, __doc__='\n    %s resource\n    ' % self.class_name))
+
+def make_record_class(spec):
+    """
+    Create compact record class of a resource type: one slot per column
+
+    @param spec ResourceSpec
+    @return class
+    """
+    def __init__(self, *values):
+        for name, value in zip(spec.columns, values):
+            setattr(self, name, value)
+    def __repr__(self):
+        return "<%s record('%s')>" % (spec.type, getattr(self, spec.columns[0]))
+    return type(spec.class_name + 'Record', (object,), dict(__slots__=spec.columns,
+        __init__=__init__, __repr__=__repr__))
+
+def index_name(table, columns):
+    """
+    Return index name: ix_<table>_<columns>
+
+    @param table table name
+    @param columns columns names
+    @return index name
+    """
+    return 'ix_%s_%s' % (table, '_'.join(columns))
+
+def sid(name='sid', key='sid'):
+    return Field(name, key, 'string', 34)
+
+def date(name, key):
+    return Field(name, key, 'datetime')
+
+def string(name, key, length):
+    return Field(name, key, 'string', length)
+
+def text(name, key):
+    return Field(name, key, 'text')
+
+def integer(name, key):
+    return Field(name, key, 'integer')
+
+def boolean(name, key):
+    return Field(name, key, 'boolean')
+
+def parent_id(name, key, parent):
+    return Field(name, key, 'id', parent=parent)
+
+resource_specs = (
+    ResourceSpec('account', 'Account', 'accounts', [
+        sid(),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        string('friendlyName', 'friendly_name', 34),
+        string('status', 'status', 16),
+        string('authToken', 'auth_token', 34),
+        text('uri', 'uri'),
+    ]),
+    ResourceSpec('call', 'Call', 'calls', [
+        sid(),
+        sid('parentCallSid', 'parent_call_sid'),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        sid('accountSid', 'account_sid'),
+        string('to', 'to', 15),
+        string('cfrom', 'from', 15),
+        sid('phoneNumberSid', 'phone_number_sid'),
+        string('status', 'status', 16),
+        date('startTime', 'start_time'),
+        date('endTime', 'end_time'),
+        integer('duration', 'duration'),
+        string('price', 'price', 16),
+        string('direction', 'direction', 16),
+        string('answeredBy', 'answered_by', 16),
+        string('forwardedFrom', 'forwarded_from', 15),
+        text('callerName', 'caller_name'),
+        text('uri', 'uri'),
+        parent_id('accountId', 'account_id', 'account'),
+    ], indexes=(('accountSid', 'dateCreated'), ('status',), ('to',), ('cfrom',))),
+    ResourceSpec('sms_message', 'SmsMessage', 'sms_messages', [
+        sid(),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        date('dateSent', 'date_sent'),
+        sid('accountSid', 'account_sid'),
+        string('cfrom', 'from', 15),
+        string('to', 'to', 15),
+        string('body', 'body', 160),
+        string('status', 'status', 16),
+        string('direction', 'direction', 16),
+        string('price', 'price', 16),
+        string('apiVersion', 'api_version', 10),
+        text('uri', 'uri'),
+        parent_id('accountId', 'account_id', 'account'),
+    ], indexes=(('accountSid', 'dateCreated'), ('status',), ('to',), ('cfrom',))),
+    ResourceSpec('recording', 'Recording', 'recordings', [
+        sid(),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        sid('accountSid', 'account_sid'),
+        sid('callSid', 'call_sid'),
+        integer('duration', 'duration'),
+        string('apiVersion', 'api_version', 10),
+        text('uri', 'uri'),
+        parent_id('callId', 'call_id', 'call'),
+        parent_id('accountId', 'account_id', 'account'),
+    ], indexes=(('accountSid', 'dateCreated'), ('callSid',))),
+    ResourceSpec('transcription', 'Transcription', 'transcriptions', [
+        sid(),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        sid('accountSid', 'account_sid'),
+        string('status', 'status', 16),
+        sid('recordingSid', 'recording_sid'),
+        integer('duration', 'duration'),
+        text('transcriptionText', 'transcription_text'),
+        string('price', 'price', 16),
+        text('uri', 'uri'),
+        parent_id('recordingId', 'recording_id', 'recording'),
+        parent_id('accountId', 'account_id', 'account'),
+    ], indexes=(('accountSid', 'dateCreated'), ('recordingSid',))),
+    ResourceSpec('notification', 'Notification', 'notifications', [
+        sid(),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        sid('accountSid', 'account_sid'),
+        sid('callSid', 'call_sid'),
+        string('apiVersion', 'api_version', 10),
+        integer('log', 'log'),
+        integer('errorCode', 'error_code'),
+        text('moreInfo', 'more_info'),
+        text('messageText', 'message_text'),
+        date('messageDate', 'message_date'),
+        text('requestUrl', 'request_url'),
+        string('requestMethod', 'request_method', 16),
+        text('requestVariables', 'request_variables'),
+        text('responseHeaders', 'response_headers'),
+        text('responseBody', 'response_body'),
+        text('uri', 'uri'),
+        parent_id('callId', 'call_id', 'call'),
+        parent_id('accountId', 'account_id', 'account'),
+    ], indexes=(('accountSid', 'dateCreated'), ('callSid',))),
+    ResourceSpec('conference', 'Conference', 'conferences', [
+        sid(),
+        text('friendlyName', 'friendly_name'),
+        string('status', 'status', 16),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        sid('accountSid', 'account_sid'),
+        text('uri', 'uri'),
+        parent_id('accountId', 'account_id', 'account'),
+    ], indexes=(('accountSid', 'dateCreated'), ('status',))),
+    ResourceSpec('participant', 'Participant', 'participants', [
+        sid('callSid', 'call_sid'),
+        sid('conferenceSid', 'conference_sid'),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        sid('accountSid', 'account_sid'),
+        boolean('muted', 'muted'),
+        boolean('startConferenceOnEnter', 'start_conference_on_enter'),
+        boolean('endConferenceOnExit', 'end_conference_on_exit'),
+        text('uri', 'uri'),
+        parent_id('callId', 'call_id', 'call'),
+        parent_id('conferenceId', 'conference_id', 'conference'),
+        parent_id('accountId', 'account_id', 'account'),
+    ], indexes=(('conferenceSid',), ('callSid',))),
+    ResourceSpec('outgoing_caller_id', 'OutgoingCallerId', 'outgoing_caller_ids', [
+        sid(),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        text('friendlyName', 'friendly_name'),
+        string('phoneNumber', 'phone_number', 15),
+        sid('accountSid', 'account_sid'),
+        text('uri', 'uri'),
+        parent_id('accountId', 'account_id', 'account'),
+    ]),
+    ResourceSpec('incoming_phone_number', 'IncomingPhoneNumber', 'incoming_phone_numbers', [
+        sid(),
+        date('dateCreated', 'date_created'),
+        date('dateUpdated', 'date_updated'),
+        text('friendlyName', 'friendly_name'),
+        sid('accountSid', 'account_sid'),
+        string('phoneNumber', 'phone_number', 15),
+        string('apiVersion', 'api_version', 10),
+        boolean('voiceCallerIdLookup', 'voice_caller_id_lookup'),
+        text('voiceUrl', 'voice_url'),
+        string('voiceMethod', 'voice_method', 16),
+        text('voiceFallbackUrl', 'voice_fallback_url'),
+        string('voiceFallbackMethod', 'voice_fallback_method', 16),
+        text('statusCallback', 'status_callback'),
+        string('statusCallbackMethod', 'status_callback_method', 16),
+        text('smsUrl', 'sms_url'),
+        string('smsMethod', 'sms_method', 16),
+        text('smsFallbackUrl', 'sms_fallback_url'),
+        string('smsFallbackMethod', 'sms_fallback_method', 16),
+        text('uri', 'uri'),
+        parent_id('accountId', 'account_id', 'account'),
+    ]),
+)
+
+# resource type -> spec
+specs = dict((s.type, s) for s in resource_specs)
+
+# types referenced by foreign keys: their row ids are cached
+parent_types = frozenset(f.parent for s in resource_specs for f in s.fields if f.kind == 'id')